@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, jsonify
 from flask_bcrypt import Bcrypt
 from flask_pymongo import PyMongo
 from config import Config
@@ -9,6 +9,14 @@ import logging
 bcrypt = Bcrypt()
 mongo = PyMongo()
 
+def init_mongo(app):
+    # Creates the MongoClient (connecting lazily)
+    mongo.init_app(app)
+
+    # Registered after PyMongo, which installs its own provider
+    from app.serialization import JSONProvider
+    app.json = JSONProvider(app)
+
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -20,12 +28,32 @@ def create_app():
     handler.setLevel(logging.DEBUG)
     logger.addHandler(handler)
     
-    # Enable CORS for all routes and origins
-    CORS(app, resources={r"/*": {"origins": "*"}}, allow_headers=["Content-Type", "Authorization"], methods=["GET", "POST", "DELETE", "PUT", "OPTIONS"])
+    # Enable CORS for all routes and origins; preflights are cached for CORS_MAX_AGE
+    CORS(app, resources={r"/*": {"origins": "*"}},
+         allow_headers=["Content-Type", "Authorization", "If-None-Match", "Last-Event-ID"],
+         expose_headers=["ETag"],
+         methods=["GET", "POST", "DELETE", "PUT", "PATCH", "OPTIONS"],
+         max_age=app.config['CORS_MAX_AGE'])
     
     bcrypt.init_app(app)
-    mongo.init_app(app)
-    
+    init_mongo(app)
+
+    from app.passwords import passwords, HashingBusy
+    passwords.configure(app.config['BCRYPT_WORKERS'], app.config['BCRYPT_QUEUE_LIMIT'], app.config['BCRYPT_LOG_ROUNDS'])
+
+    @app.errorhandler(HashingBusy)
+    def hashing_busy(e):
+        response = jsonify({"status": "error", "error": "Server is busy, try again shortly"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    from app.admission import init_admission
+    init_admission(app)
+
+    # Hub for the server-sent event streams of this worker
+    from app.events import hub, load_fanout
+    hub.configure(load_fanout(app.config['EVENTS_FANOUT']), app.config['EVENTS_QUEUE_SIZE'])
+
     from app.routes.users import users_bp
     from app.routes.jobs import jobs_bp
     from app.routes.resume import resume_bp
@@ -43,5 +71,49 @@ def create_app():
     app.register_blueprint(messages_bp, url_prefix='/messages')
     app.register_blueprint(admins_bp, url_prefix='/admins')
     app.register_blueprint(reports_bp, url_prefix='/reports')
+
+    from app.commands import register_commands
+    register_commands(app)
+
+    from app.models import configure_caches
+    from app.utils import token_cache
+    configure_caches(app.config)
+    token_cache.configure(maxsize=app.config['TOKEN_CACHE_SIZE'], ttl=app.config['TOKEN_CACHE_SECONDS'])
+
+    if app.config['MONGO_ENSURE_INDEXES']:
+        from app.models import ensure_indexes, check_indexes, log_index_report, log_index_failures
+        try:
+            _, failed = ensure_indexes()
+            log_index_failures(failed)
+            log_index_report(check_indexes())
+        except Exception as e:
+            # Don't refuse to start because of an index problem, but make it visible
+            logging.getLogger(__name__).error("Could not ensure MongoDB indexes: %s", e)
+
+    from app.search import init_job_search
+    init_job_search(app)
     
-    return app
\ No newline at end of file
+    return app
+
+# Preforking servers (gunicorn.conf.py) load the app once and fork the workers
+# from it. Neither the MongoClient nor threads survive a fork, so the loaded app
+# lets go of them before forking and every worker creates its own.
+
+def before_fork(app):
+    from app.search import stop_job_search_resync
+    from app.events import hub
+    stop_job_search_resync(app)
+    hub.close()
+    mongo.cx.close()
+
+def init_worker(app):
+    init_mongo(app)
+
+    from app.passwords import passwords
+    passwords.configure(app.config['BCRYPT_WORKERS'], app.config['BCRYPT_QUEUE_LIMIT'], app.config['BCRYPT_LOG_ROUNDS'])
+
+    from app.events import hub, load_fanout
+    hub.configure(load_fanout(app.config['EVENTS_FANOUT']), app.config['EVENTS_QUEUE_SIZE'])
+
+    from app.search import start_job_search_resync
+    start_job_search_resync(app)
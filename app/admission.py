@@ -0,0 +1,138 @@
+from flask import request, g, jsonify, current_app
+import threading
+
+# Admission control
+# Each route class (an endpoint such as "messages.get_messages_for_user", a
+# blueprint, or "exports" for current_page=0 listings) can be given a limit of
+# concurrent requests plus a short queue, e.g. ADMISSION_LIMITS =
+# "exports=2:4,reports=4:8". Limiting single endpoints keeps cheap ones (the
+# unread badge, mark-read) out of the queue of an expensive neighbour. A request
+# counts against its most specific listed class. Requests past the limit wait up to
+# ADMISSION_WAIT_SECONDS for a slot; when the queue is full or the wait runs out
+# they get a 503 with Retry-After, so a slow endpoint can't occupy every worker.
+# Views can also be put in a class of their own with @admission_class, e.g. the
+# long-lived event streams, which hold a server thread for as long as they are
+# open. Route classes that aren't listed are not limited.
+
+class Overloaded(Exception):
+    pass
+
+class AdmissionLimit:
+    def __init__(self, name, limit, queue, wait):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self):
+        with self._condition:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.queue:
+                    self.rejected += 1
+                    raise Overloaded(self.name)
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self.in_flight < self.limit, self.wait)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+                    raise Overloaded(self.name)
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+# Limits by route class, set up by init_admission
+limits = {}
+
+def parse_limits(value):
+    # "name=limit:queue,..." -> {name: (limit, queue)}
+    parsed = {}
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            name, sizes = entry.split('=')
+            limit, queue = sizes.split(':')
+            parsed[name.strip()] = (int(limit), int(queue))
+        except ValueError:
+            raise ValueError("Invalid ADMISSION_LIMITS entry '%s', expected name=limit:queue" % entry)
+    return parsed
+
+def admission_class(name):
+    def decorator(f):
+        f.admission_class = name
+        return f
+    return decorator
+
+def route_class():
+    # The most specific configured class of the current request, if any
+    name = getattr(current_app.view_functions.get(request.endpoint), 'admission_class', None)
+    if name is not None:
+        return name if name in limits else None
+    if request.args.get('current_page') == '0' and 'exports' in limits:
+        return 'exports'
+    if request.endpoint in limits:
+        return request.endpoint
+    if request.blueprint in limits:
+        return request.blueprint
+    return None
+
+def admission_stats():
+    return {name: limit.stats() for name, limit in limits.items()}
+
+def init_admission(app):
+    limits.clear()
+    for name, (limit, queue) in parse_limits(app.config['ADMISSION_LIMITS']).items():
+        limits[name] = AdmissionLimit(name, limit, queue, app.config['ADMISSION_WAIT_SECONDS'])
+
+    @app.before_request
+    def admit():
+        if request.method == 'OPTIONS':
+            return
+        name = route_class()
+        if name is not None:
+            limits[name].acquire()
+            g.admission = limits[name]
+
+    @app.after_request
+    def leave(response):
+        # The slot is held until the response is closed, so streamed responses
+        # keep it until their last row is sent
+        limit = g.pop('admission', None)
+        if limit is not None:
+            response.call_on_close(limit.release)
+        return response
+
+    @app.teardown_request
+    def leave_on_error(exc):
+        # Requests that never produced a response
+        limit = g.pop('admission', None)
+        if limit is not None:
+            limit.release()
+
+    @app.errorhandler(Overloaded)
+    def overloaded(e):
+        response = jsonify({"status": "error", "error": "Server is busy, try again shortly"})
+        response.headers['Retry-After'] = str(app.config['ADMISSION_RETRY_AFTER'])
+        return response, 503
@@ -0,0 +1,61 @@
+import click
+from app.models import ensure_indexes, check_indexes, backfill_message_fields, reconcile_unread_counts
+from app.rollups import build_rollups
+
+# Flask CLI commands (run with `flask --app run <command>`)
+
+def register_commands(app):
+    app.cli.add_command(db_indexes)
+    app.cli.add_command(messages_backfill)
+    app.cli.add_command(stats_rollup)
+    app.cli.add_command(messages_unread_reconcile)
+
+@click.command('db-indexes')
+@click.option('--check', is_flag=True, help="Only report missing or extra indexes, don't create anything.")
+def db_indexes(check):
+    failed = False
+    if not check:
+        created, errors = ensure_indexes()
+        for collection_name, names in created.items():
+            click.echo(f"{collection_name}: ensured {', '.join(names)}")
+        for collection_name, index_errors in errors.items():
+            for name, error in index_errors.items():
+                failed = True
+                click.echo(f"{collection_name}: could not create {name}: {error}")
+
+    for collection_name, problems in check_indexes().items():
+        for kind, names in problems.items():
+            if names:
+                failed = failed or kind != "extra"
+                click.echo(f"{collection_name}: {kind} {', '.join(names)}")
+
+    if failed:
+        raise SystemExit(1)
+    click.echo("Indexes are up to date")
+
+@click.command('messages-backfill')
+@click.option('--batch-size', default=500, show_default=True, help="Messages written per bulk_write.")
+@click.option('--resync', is_flag=True, help="Rewrite every message, not only those missing fields.")
+def messages_backfill(batch_size, resync):
+    total = 0
+    for updated in backfill_message_fields(batch_size=batch_size, resync=resync):
+        total += updated
+        click.echo(f"Updated {total} messages")
+    click.echo(f"Done, {total} messages updated")
+
+@click.command('stats-rollup')
+@click.option('--since', type=click.DateTime(formats=["%Y-%m-%d"]), help="Rebuild closed days from this day on.")
+@click.option('--resync', is_flag=True, help="Rebuild every closed day, not only new ones.")
+def stats_rollup(since, resync):
+    # Meant to run daily (e.g. from cron); reports also build missing days on demand
+    days = build_rollups(since=since, resync=resync)
+    click.echo(f"Done, {days} days written to daily_stats")
+
+@click.command('messages-unread-reconcile')
+@click.option('--batch-size', default=500, show_default=True, help="Users recounted per aggregation.")
+def messages_unread_reconcile(batch_size):
+    total = 0
+    for updated in reconcile_unread_counts(batch_size=batch_size):
+        total += updated
+        click.echo(f"Corrected {total} unread counters")
+    click.echo(f"Done, {total} unread counters corrected")
@@ -1,49 +1,44 @@
 from functools import wraps
-from flask import request, jsonify, current_app
-import jwt
+from flask import jsonify
+from app.utils import bearer_token, decode_token
+
+# Claims of the request's token, or the error response when it's missing or invalid.
+# Verified tokens are cached, see app.utils.decode_token.
+def token_claims():
+    token = bearer_token()
+    if not token:
+        return None, (jsonify({"error": "Token is missing!"}), 401)
+    try:
+        return decode_token(token), None
+    except Exception as e:
+        return None, (jsonify({"error": "Token is invalid!", "message": str(e)}), 401)
 
 # Used for collections related to the users:
 def token_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({"error": "Token is missing!"}), 401
-        
-        try:
-            if token.startswith('Bearer '):
-                token = token.split(" ")[1]
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = data['user_id']
-        except Exception as e:
-            return jsonify({"error": "Token is invalid!", "message": str(e)}), 401
+        claims, error = token_claims()
+        if error:
+            return error
+        if 'user_id' not in claims:
+            return jsonify({"error": "Token is invalid!", "message": "Token has no user_id"}), 401
+
+        return f(claims['user_id'], *args, **kwargs)
 
-        return f(current_user, *args, **kwargs)
-    
     return decorated_function
 
 # Used for collections related to the admins:
-def token_required_admin(f): 
+def token_required_admin(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({"error": "Token is missing!"}), 401
-        
-        try:
-            if token.startswith('Bearer '):
-                token = token.split(" ")[1]
-            
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            if data.get('role') != 'admin':
-                return jsonify({"error": "Admin access required!"}), 403
-            
-            current_admin = data['admin_id']
-        except Exception as e:
-            return jsonify({"error": "Token is invalid!", "message": str(e)}), 401
+        claims, error = token_claims()
+        if error:
+            return error
+        if claims.get('role') != 'admin':
+            return jsonify({"error": "Admin access required!"}), 403
+        if 'admin_id' not in claims:
+            return jsonify({"error": "Token is invalid!", "message": "Token has no admin_id"}), 401
+
+        return f(claims['admin_id'], *args, **kwargs)
 
-        return f(current_admin, *args, **kwargs)
-    
     return decorated_function
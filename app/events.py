@@ -0,0 +1,199 @@
+from flask import current_app
+from pymongo.errors import PyMongoError
+from app import mongo
+import datetime
+import importlib
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Server-sent events
+# Connected clients subscribe to a channel (their user id) on the hub of their
+# worker. Events are published through a fan-out, which delivers them to the hub
+# of every worker that may hold a subscriber. LocalFanout only delivers inside
+# this process, which is enough for a single worker; MongoFanout goes through
+# MongoDB and reaches every worker of every server. EVENTS_FANOUT can also name
+# another class ("package.module:Class") that calls `deliver` in every process.
+#
+# Event ids are message ids, so a client that reconnects with Last-Event-ID gets
+# what it missed from the messages collection. Waiting clients cost no queries.
+
+class LocalFanout:
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, channel, event):
+        self._deliver(channel, event)
+
+    def close(self):
+        pass
+
+# Events are inserted into the event_fanout collection (expiring after an hour,
+# see app.models.INDEXES) and every process follows the inserts with a change
+# stream, resuming where it left off after an error. Change streams need a
+# replica set; a single-node one will do.
+class MongoFanout:
+    def start(self, deliver):
+        self._deliver = deliver
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._follow, name="events-fanout", daemon=True)
+        self._thread.start()
+
+    def publish(self, channel, event):
+        try:
+            mongo.db.event_fanout.insert_one(
+                {"channel": channel, "event": event, "created_at": datetime.datetime.utcnow()})
+        except PyMongoError as e:
+            # The message itself is stored; the client gets it when it reconnects
+            logger.error("Could not publish an event for %s: %s", channel, e)
+
+    def _follow(self):
+        resume_token = None
+        while not self._stopped.is_set():
+            try:
+                with mongo.db.event_fanout.watch([{"$match": {"operationType": "insert"}}],
+                                                 resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    while not self._stopped.is_set():
+                        change = stream.try_next()
+                        resume_token = stream.resume_token
+                        if change is not None:
+                            document = change["fullDocument"]
+                            self._deliver(document["channel"], document["event"])
+            except PyMongoError as e:
+                logger.error("Event change stream failed, retrying: %s", e)
+                self._stopped.wait(1)
+
+    def close(self):
+        self._stopped.set()
+
+FANOUTS = {
+    "local": LocalFanout,
+    "mongo": MongoFanout
+}
+
+def load_fanout(name):
+    if name in FANOUTS:
+        return FANOUTS[name]()
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError("EVENTS_FANOUT must be one of %s or 'package.module:Class'" % ", ".join(FANOUTS))
+    return getattr(importlib.import_module(module_name), class_name)()
+
+class Subscription:
+    def __init__(self, channel, size):
+        self.channel = channel
+        self._queue = queue.Queue(size)
+        # Set when events had to be dropped; the stream then ends and the
+        # client catches up with Last-Event-ID
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        # The next event, or None after `timeout` seconds
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._fanout = None
+        self.queue_size = 100
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def configure(self, fanout, queue_size):
+        self.close()
+        self._fanout = fanout
+        self.queue_size = queue_size
+        fanout.start(self.deliver)
+
+    def close(self):
+        if self._fanout is not None:
+            self._fanout.close()
+            self._fanout = None
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, event):
+        self.published += 1
+        if self._fanout is None:
+            self.deliver(channel, event)
+        else:
+            self._fanout.publish(channel, event)
+
+    def deliver(self, channel, event):
+        # Called by the fan-out, possibly from its own thread
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            already_overflowed = subscription.overflowed
+            subscription.put(event)
+            if subscription.overflowed and not already_overflowed:
+                self.overflows += 1
+            else:
+                self.delivered += 1
+
+    def stats(self):
+        with self._lock:
+            channels = len(self._subscribers)
+            subscribers = sum(len(subscribers) for subscribers in self._subscribers.values())
+        return {
+            "fanout": type(self._fanout).__name__ if self._fanout else None,
+            "channels": channels,
+            "subscribers": subscribers,
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows
+        }
+
+hub = EventHub()
+
+# Events are plain dicts with the data already encoded, so any fan-out can carry them:
+# {"id": <message id>, "event": "message", "data": <JSON text>}
+def message_event(message):
+    data = {
+        "id": message['_id'],
+        "application_id": message.get('application_id'),
+        "job_id": message.get('job_id'),
+        "sender_id": message.get('sender_id'),
+        "message": message['message'],
+        "status": message.get('status'),
+        "read_status": message.get('read_status'),
+        "timestamp": message.get('timestamp'),
+        "sender_username": message.get('sender_username') or 'Unknown',
+        "job_name": message.get('job_title') or 'Unknown Job',
+        "company_name": message.get('company_name') or 'Unknown Company'
+    }
+    return {"id": str(message['_id']), "event": "message", "data": current_app.json.dumps(data)}
+
+# Tells the receiver of a new message (status changes are sent as messages)
+def publish_message(message):
+    hub.publish(str(message['receiver_id']), message_event(message))
+
+def format_event(event):
+    lines = ["id: " + event['id'], "event: " + event['event']]
+    lines.extend("data: " + line for line in event['data'].splitlines())
+    return "\n".join(lines) + "\n\n"
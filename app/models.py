@@ -1,6 +1,13 @@
 from app import mongo
+from app.cache import named_cache
+from app.rollups import count_between, histogram_cache
+from flask import g
 from bson.objectid import ObjectId
+from bson import json_util
+from pymongo import IndexModel, UpdateOne, UpdateMany, ASCENDING, DESCENDING, TEXT
 import datetime  # Add this to handle timestamps
+import logging
+import copy
 
 # Collection Access Functions
 
@@ -39,19 +46,355 @@ def get_admins_collection():
         raise RuntimeError("MongoDB not initialized")
     return mongo.db.admins
 
+def get_job_tombstones_collection():
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    return mongo.db.job_tombstones
+
+# For module-level handles in the blueprints: looks the collection up on every
+# use, so the handle follows mongo.db when a forked worker creates its own client
+class CollectionProxy:
+    def __init__(self, get_collection):
+        self._get_collection = get_collection
+
+    def __getattr__(self, name):
+        return getattr(self._get_collection(), name)
+
+# Index Registry
+# Every query pattern used by the routes should be backed by one of these indexes.
+# Keys are collection names, values are the indexes that collection must have.
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("createdAt", ASCENDING)], name="created_at"),
+    ],
+    "admins": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    # Compound (..., sort field, _id) indexes also serve keyset pagination
+    "jobs": [
+        IndexModel([("posted_by.user_id", ASCENDING), ("date_posted", DESCENDING), ("_id", DESCENDING)],
+                   name="posted_by_user_date_posted"),
+        IndexModel([("date_posted", DESCENDING), ("_id", DESCENDING)], name="date_posted"),
+        # Job search: keyword (text) search and one index per exact-match filter
+        IndexModel([("title", TEXT), ("description", TEXT), ("requirements", TEXT)], name="job_text",
+                   weights={"title": 10, "requirements": 3, "description": 1}),
+        IndexModel([("sector", ASCENDING), ("date_posted", DESCENDING), ("_id", DESCENDING)], name="sector_date_posted"),
+        IndexModel([("location", ASCENDING), ("date_posted", DESCENDING), ("_id", DESCENDING)], name="location_date_posted"),
+        IndexModel([("job_type", ASCENDING), ("date_posted", DESCENDING), ("_id", DESCENDING)], name="job_type_date_posted"),
+        IndexModel([("company_name", ASCENDING), ("date_posted", DESCENDING), ("_id", DESCENDING)],
+                   name="company_name_date_posted"),
+        # Lets the in-memory search index pick up changes made by other processes
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "job_applications": [
+        IndexModel([("job_id", ASCENDING), ("date_applied", DESCENDING), ("_id", DESCENDING)], name="job_date_applied"),
+        IndexModel([("user_id", ASCENDING), ("date_applied", DESCENDING), ("_id", DESCENDING)], name="user_date_applied"),
+        # Date range counts of the reports and daily rollups, and the application funnel
+        IndexModel([("date_applied", ASCENDING), ("status", ASCENDING)], name="date_applied_status"),
+    ],
+    "messages": [
+        IndexModel([("receiver_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="receiver_timestamp"),
+        IndexModel([("application_id", ASCENDING)], name="application"),
+        # Used to propagate username and job title changes into messages
+        IndexModel([("sender_id", ASCENDING)], name="sender"),
+        IndexModel([("job_id", ASCENDING)], name="job"),
+        # Date range counts of the daily rollups
+        IndexModel([("timestamp", ASCENDING)], name="timestamp"),
+        # Last-Event-ID replay of the event stream
+        IndexModel([("receiver_id", ASCENDING), ("_id", ASCENDING)], name="receiver_id_order"),
+    ],
+    "resumes": [
+        IndexModel([("user_id", ASCENDING)], name="user_unique", unique=True),
+    ],
+    "companies": [
+        IndexModel([("user_id", ASCENDING)], name="user"),
+    ],
+    # Deleted job ids, read by the in-memory search index of every process; kept
+    # for a week, far longer than any process goes without syncing
+    "job_tombstones": [
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    # Events on their way to the other processes (EVENTS_FANOUT=mongo), which
+    # follow them live; clients that miss some catch up from the messages
+    "event_fanout": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=3600),
+    ],
+}
+
+def ensure_indexes():
+    # create_indexes is a no-op for indexes that already exist with the same spec.
+    # Indexes are created one at a time so one that can't be built (e.g. a unique
+    # index over duplicate data) doesn't leave the others missing.
+    # Returns ({collection: [created names]}, {collection: {index name: error}}).
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    created = {}
+    failed = {}
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                created.setdefault(collection_name, []).extend(mongo.db[collection_name].create_indexes([index]))
+            except Exception as e:
+                failed.setdefault(collection_name, {})[index.document["name"]] = str(e)
+    return created, failed
+
+def index_matches(document, info):
+    # `document` is an IndexModel document, `info` the index_information() entry.
+    # The server reports text indexes with the key [('_fts', 'text'), ('_ftsx', 1)],
+    # so those are compared by their fields' weights and default language instead.
+    fields = list(document["key"].items())
+    text_fields = [field for field, kind in fields if kind == TEXT]
+    if not text_fields:
+        return fields == list(info["key"])
+    declared = document.get("weights", {})
+    weights = {field: declared.get(field, 1) for field in text_fields}
+    return (info.get("weights") == weights
+            and info.get("default_language", "english") == document.get("default_language", "english"))
+
+def check_indexes():
+    # Compare the registry with what the database actually has
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        expected = {index.document["name"]: index.document for index in indexes}
+        existing = {
+            name: info
+            for name, info in mongo.db[collection_name].index_information().items()
+            if name != "_id_"
+        }
+        missing = sorted(name for name in expected if name not in existing)
+        extra = sorted(name for name in existing if name not in expected)
+        mismatched = sorted(
+            name for name in expected
+            if name in existing and not index_matches(expected[name], existing[name])
+        )
+        report[collection_name] = {"missing": missing, "extra": extra, "mismatched": mismatched}
+    return report
+
+def log_index_failures(failed):
+    logger = logging.getLogger(__name__)
+    for collection_name, errors in failed.items():
+        for name, error in errors.items():
+            logger.error("Could not create index '%s' on '%s': %s", name, collection_name, error)
+
+def log_index_report(report):
+    logger = logging.getLogger(__name__)
+    for collection_name, problems in report.items():
+        for kind, names in problems.items():
+            if names:
+                logger.warning("Collection '%s' has %s indexes: %s", collection_name, kind, ", ".join(names))
+
+# Request-scoped batch loader
+# Routes queue the ids they are going to need and then read the documents back one
+# by one. Each collection is fetched with a single $in query and the documents are
+# memoized for the rest of the request, so enriching N rows costs one query per
+# collection instead of one per row.
+class BatchLoader:
+    # Fields that are never handed out through the loader
+    PROJECTIONS = {
+        "users": {"password": 0},
+        "admins": {"password": 0}
+    }
+
+    def __init__(self):
+        self._queued = {}
+        self._loaded = {}
+
+    def queue(self, collection_name, *ids):
+        loaded = self._loaded.setdefault(collection_name, {})
+        queued = self._queued.setdefault(collection_name, set())
+        for _id in ids:
+            if _id is not None and ObjectId(_id) not in loaded:
+                queued.add(ObjectId(_id))
+        return self
+
+    def get(self, collection_name, _id):
+        if _id is None:
+            return None
+        _id = ObjectId(_id)
+        loaded = self._loaded.setdefault(collection_name, {})
+        if _id not in loaded:
+            self.queue(collection_name, _id)
+            self._fetch(collection_name)
+        return loaded[_id]
+
+    def _fetch(self, collection_name):
+        ids = self._queued.pop(collection_name, set())
+        if not ids:
+            return
+        if mongo.db is None:
+            raise RuntimeError("MongoDB not initialized")
+        loaded = self._loaded[collection_name]
+        query = {"_id": {"$in": list(ids)}}
+        for document in mongo.db[collection_name].find(query, self.PROJECTIONS.get(collection_name)):
+            loaded[document["_id"]] = document
+        # Remember misses too, so a missing document is not looked up again
+        for _id in ids:
+            loaded.setdefault(_id, None)
+
+def get_loader():
+    # One loader per request (flask.g lives as long as the app context)
+    if 'loader' not in g:
+        g.loader = BatchLoader()
+    return g.loader
+
+# Collection Versions
+# A counter per collection that the write paths bump. List endpoints build their
+# ETag from it, so answering a conditional GET costs one primary-key read.
+def get_collection_versions(*collection_names):
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    found = {
+        document["_id"]: document["version"]
+        for document in mongo.db.collection_versions.find({"_id": {"$in": list(collection_names)}})
+    }
+    return tuple(found.get(name, 0) for name in collection_names)
+
+def bump_collection_version(*collection_names):
+    # Also drops the counts memoized for these collections in this process
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    mongo.db.collection_versions.bulk_write([
+        UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in collection_names
+    ], ordered=False)
+    for name in collection_names:
+        invalidate_counts(name)
+
+# Listing Versions
+# Per-user listings (inbox, my applications, applications to my job, my jobs)
+# aren't validated against the collection versions, which any user's write
+# changes, but against a counter per listing and owner, e.g. ("inbox", receiver
+# id). Writes bump the listings whose rows they add, remove or change, including
+# edits of the job or username a row is displayed with, so answering a
+# conditional GET stays one primary-key read.
+def listing_key(listing, owner_id):
+    return f"{listing}:{owner_id}"
+
+def get_listing_version(listing, owner_id):
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    document = mongo.db.listing_versions.find_one({"_id": listing_key(listing, owner_id)})
+    return (document["version"] if document else 0,)
+
+def bump_listing_versions(**owner_ids):
+    # owner_ids: listing name -> ids of the owners whose listing changed, one bulk_write for all of them
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    keys = {listing_key(listing, owner_id) for listing, ids in owner_ids.items() for owner_id in ids if owner_id is not None}
+    if keys:
+        mongo.db.listing_versions.bulk_write([
+            UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in keys
+        ], ordered=False)
+
+# Counting
+# List endpoints take `count=exact|approx|none`. `approx` (the default) uses the
+# collection metadata for unfiltered counts and memoizes filtered counts for
+# COUNT_CACHE_SECONDS; `none` skips counting, for infinite scroll clients.
+COUNT_STRATEGIES = ('exact', 'approx', 'none')
+count_cache = named_cache("counts", maxsize=4096, ttl=30)
+_count_generations = {}  # collection name -> generation, part of the memo key
+
+def count_documents(collection, query, strategy='approx'):
+    if strategy == 'none':
+        return None
+    if strategy == 'exact':
+        return collection.count_documents(query)
+    if not query:
+        return collection.estimated_document_count()
+
+    key = (collection.name, _count_generations.get(collection.name, 0), json_util.dumps(query, sort_keys=True))
+    count = count_cache.get(key)
+    if count is None:
+        count = collection.count_documents(query)
+        count_cache.set(key, count)
+    return count
+
+def invalidate_counts(collection_name):
+    # Older memo entries become unreachable and age out of the cache
+    _count_generations[collection_name] = _count_generations.get(collection_name, 0) + 1
+
+# Entity Cache
+# Jobs, companies, user profiles and resumes are read much more often than they
+# change, so their helpers read through these caches. Write paths call the
+# invalidate_* helpers; other processes see changes after ENTITY_CACHE_SECONDS.
+job_cache = named_cache("jobs")
+company_cache = named_cache("companies")
+user_profile_cache = named_cache("user_profiles")
+resume_cache = named_cache("resumes")
+
+def configure_caches(config):
+    for cache in (job_cache, company_cache, user_profile_cache, resume_cache):
+        cache.configure(maxsize=config['ENTITY_CACHE_SIZE'], ttl=config['ENTITY_CACHE_SECONDS'])
+    count_cache.configure(ttl=config['COUNT_CACHE_SECONDS'])
+    histogram_cache.configure(ttl=config['HISTOGRAM_CACHE_SECONDS'])
+
+def read_through(cache, key, load, fields=None):
+    # `load` is called with a projection, None for the whole document. With
+    # `fields` (?fields= of the route), a cached document is still used, but a
+    # miss only reads those fields and the partial document isn't cached.
+    document = cache.get(key)
+    if document is None:
+        if fields is not None:
+            return load({field: 1 for field in fields})
+        document = load(None)
+        if document is None:
+            return None
+        cache.set(key, document)
+    # Callers are free to modify what they get back
+    return copy.deepcopy(document)
+
+def invalidate_job(job_id):
+    job_cache.delete(ObjectId(job_id))
+
+# Lets the search index of other processes drop a deleted job
+def record_job_deletion(job_id):
+    get_job_tombstones_collection().replace_one(
+        {"_id": ObjectId(job_id)},
+        {"deleted_at": datetime.datetime.utcnow()},
+        upsert=True
+    )
+
+def invalidate_company(company_id):
+    company_cache.delete(ObjectId(company_id))
+
+def invalidate_user_profile(user_id):
+    user_profile_cache.delete(ObjectId(user_id))
+
+def invalidate_resume(user_id):
+    resume_cache.delete(ObjectId(user_id))
+
 # Helper Functions
 
 def get_user_by_id(user_id):
     users_collection = get_users_collection()
     return users_collection.find_one({"_id": ObjectId(user_id)})
 
+def get_user_profile_by_id(user_id, fields=None):
+    # The user without the password hash
+    return read_through(user_profile_cache, ObjectId(user_id),
+                        lambda projection: get_users_collection().find_one({"_id": ObjectId(user_id)}, projection or {"password": 0}),
+                        fields)
+
+def get_job_by_id(job_id):
+    return read_through(job_cache, ObjectId(job_id),
+                        lambda projection: get_jobs_collection().find_one({"_id": ObjectId(job_id)}))
+
+def get_resume_by_user_id(user_id, fields=None):
+    return read_through(resume_cache, ObjectId(user_id),
+                        lambda projection: get_resumes_collection().find_one({"user_id": ObjectId(user_id)}, projection),
+                        fields)
+
 def get_job_application_by_id(application_id):
     applications_collection = get_job_applications_collection()
     return applications_collection.find_one({"_id": ObjectId(application_id)})
 
 def get_company_by_id(company_id):
-    companies_collection = get_companies_collection()
-    return companies_collection.find_one({"_id": ObjectId(company_id)})
+    return read_through(company_cache, ObjectId(company_id),
+                        lambda projection: get_companies_collection().find_one({"_id": ObjectId(company_id)}))
 
 def get_message_by_id(message_id):
     messages_collection = get_messages_collection()
@@ -62,10 +405,101 @@ def get_messages_by_application_id(application_id):
     return list(messages_collection.find({"application_id": ObjectId(application_id)}))
 
 def mark_message_as_read(message_id):
+    # Returns True if the message was unread; only then the receiver's counter goes down
+    messages_collection = get_messages_collection()
+    message = messages_collection.find_one_and_update(
+        {"_id": ObjectId(message_id), "read_status": "unread"},
+        {"$set": {"read_status": "read"}},
+        projection={"receiver_id": 1})
+    if message is None:
+        return False
+    change_unread_count(message["receiver_id"], -1)
+    invalidate_counts("messages")
+    bump_listing_versions(inbox=[message["receiver_id"]])
+    return True
+
+# Unread counters
+# Users carry the number of unread messages they received (`unread_count`), so the
+# inbox badge is a single-field read. Sending a message increments it, marking an
+# unread message as read decrements it; `flask messages-unread-reconcile` recomputes
+# the counters from the messages if they ever drift.
+
+def change_unread_count(user_id, delta):
+    query = {"_id": ObjectId(user_id)}
+    if delta < 0:
+        query["unread_count"] = {"$gte": -delta}  # Never below zero
+    get_users_collection().update_one(query, {"$inc": {"unread_count": delta}})
+
+def increment_unread_counts(counts):
+    # counts: {user_id: number of new messages}, one bulk_write for all of them
+    if counts:
+        get_users_collection().bulk_write([
+            UpdateOne({"_id": ObjectId(user_id)}, {"$inc": {"unread_count": count}})
+            for user_id, count in counts.items()
+        ], ordered=False)
+
+def mark_messages_as_read(user_id, message_ids):
+    # Marks the messages of `user_id` among `message_ids` as read with one update_many.
+    # Returns {message id: "read" | "already_read" | "not_found"}.
+    messages_collection = get_messages_collection()
+    valid_ids = [ObjectId(message_id) for message_id in message_ids if ObjectId.is_valid(message_id)]
+    found = {
+        message["_id"]: message["read_status"]
+        for message in messages_collection.find(
+            {"_id": {"$in": valid_ids}, "receiver_id": ObjectId(user_id)}, {"read_status": 1})
+    }
+    unread = [_id for _id, read_status in found.items() if read_status == "unread"]
+    if unread:
+        result = messages_collection.update_many(
+            {"_id": {"$in": unread}, "read_status": "unread"},
+            {"$set": {"read_status": "read"}})
+        if result.modified_count:
+            change_unread_count(user_id, -result.modified_count)
+            invalidate_counts("messages")
+            bump_listing_versions(inbox=[user_id])
+
+    results = {}
+    for message_id in message_ids:
+        _id = ObjectId(message_id) if ObjectId.is_valid(message_id) else None
+        if _id not in found:
+            results[message_id] = "not_found"
+        else:
+            results[message_id] = "read" if found[_id] == "unread" else "already_read"
+    return results
+
+def get_unread_count(user_id):
+    user = get_users_collection().find_one({"_id": ObjectId(user_id)}, {"unread_count": 1})
+    if user is None:
+        return None
+    return user.get("unread_count", 0)
+
+def reconcile_unread_counts(batch_size=500):
+    # Walks the users in _id order and sets their counters from the messages,
+    # one aggregation per batch. Yields the number of users updated per batch.
+    users_collection = get_users_collection()
     messages_collection = get_messages_collection()
-    return messages_collection.update_one(
-        {"_id": ObjectId(message_id)},
-        {"$set": {"read_status": "read"}})
+    last_id = None
+
+    while True:
+        batch_query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        user_ids = [user["_id"] for user in users_collection.find(batch_query, {"_id": 1}).sort("_id", ASCENDING).limit(batch_size)]
+        if not user_ids:
+            return
+        last_id = user_ids[-1]
+
+        counts = {
+            row["_id"]: row["count"]
+            for row in messages_collection.aggregate([
+                {"$match": {"receiver_id": {"$in": user_ids}, "read_status": "unread"}},
+                {"$group": {"_id": "$receiver_id", "count": {"$sum": 1}}}
+            ])
+        }
+        operations = [
+            UpdateOne({"_id": user_id}, {"$set": {"unread_count": counts.get(user_id, 0)}})
+            for user_id in user_ids
+        ]
+        result = users_collection.bulk_write(operations, ordered=False)
+        yield result.modified_count
 
 def get_admin_by_email(email):
     admins_collection = get_admins_collection()
@@ -87,22 +521,142 @@ def create_admin(username, email, hashed_password):
     return new_admin
 
 # Reporting Functions
+# Report counts come from the daily rollups, see app/rollups.py
 def get_users_count_by_date_range(start_date, end_date):
-    users_collection = get_users_collection()
-    return users_collection.count_documents({
-        "created_at": {"$gte": start_date, "$lt": end_date}
-    })
+    return count_between("signups", start_date, end_date)
 
 def get_jobs_count_by_date_range(start_date, end_date):
-    jobs_collection = get_jobs_collection()
-    return jobs_collection.count_documents({
-        "created_at": {"$gte": start_date, "$lt": end_date}
-    })
+    return count_between("jobs_posted", start_date, end_date)
 
 def get_applicants_count_by_date_range(start_date, end_date):
-    jobs_collection = get_jobs_collection()
-    return jobs_collection.aggregate([
-        {"$unwind": "$applications"},
-        {"$match": {"applications.created_at": {"$gte": start_date, "$lt": end_date}}},
-        {"$count": "applicants_count"}
-    ]).next().get('applicants_count', 0)
+    return count_between("applications", start_date, end_date)
+
+# Application funnel
+# Applications made in a date range counted by status, optionally per job sector or
+# company, with the time from applying to the first status change (the first
+# message of the application). One pipeline, starting on the (date_applied, status) index.
+FUNNEL_GROUPS = ('sector', 'company_name')
+
+def get_application_funnel(start_date, end_date, group_by=None):
+    pipeline = [{"$match": {"date_applied": {"$gte": start_date, "$lt": end_date}}}]
+    if group_by is not None:
+        pipeline += [
+            {"$lookup": {
+                "from": "jobs",
+                "let": {"job_id": "$job_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$job_id"]}}},
+                    {"$project": {group_by: 1}}
+                ],
+                "as": "job"
+            }},
+            {"$addFields": {"group": {"$arrayElemAt": ["$job." + group_by, 0]}}}
+        ]
+    pipeline += [
+        {"$lookup": {
+            "from": "messages",
+            "let": {"application_id": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$application_id", "$$application_id"]}}},
+                {"$sort": {"timestamp": 1}},
+                {"$limit": 1},
+                {"$project": {"timestamp": 1}}
+            ],
+            "as": "first_message"
+        }},
+        {"$addFields": {"first_change_ms": {
+            "$subtract": [{"$arrayElemAt": ["$first_message.timestamp", 0]}, "$date_applied"]
+        }}},
+        {"$group": {
+            "_id": {"group": "$group" if group_by is not None else None, "status": "$status"},
+            "count": {"$sum": 1},
+            "changed": {"$sum": {"$cond": [{"$gt": [{"$size": "$first_message"}, 0]}, 1, 0]}},
+            "first_change_ms_total": {"$sum": {"$ifNull": ["$first_change_ms", 0]}}
+        }}
+    ]
+
+    funnel = {}
+    for row in get_job_applications_collection().aggregate(pipeline):
+        group = funnel.setdefault(row["_id"]["group"], {
+            "group": row["_id"]["group"], "total": 0, "statuses": {}, "changed": 0, "first_change_ms_total": 0
+        })
+        group["total"] += row["count"]
+        group["statuses"][row["_id"]["status"]] = row["count"]
+        group["changed"] += row["changed"]
+        group["first_change_ms_total"] += row["first_change_ms_total"]
+
+    result = []
+    for group in sorted(funnel.values(), key=lambda group: -group["total"]):
+        changed = group.pop("changed")
+        total_ms = group.pop("first_change_ms_total")
+        group["with_status_change"] = changed
+        group["avg_hours_to_first_status_change"] = round(total_ms / changed / 3600000, 2) if changed else None
+        result.append(group)
+    return result
+
+# Denormalized Message Fields
+# Messages carry the usernames, job title and company name they are displayed with,
+# so the inbox doesn't have to join users and jobs on every read.
+MESSAGE_DENORMALIZED_FIELDS = ("sender_username", "receiver_username", "job_title", "company_name")
+
+def message_denormalized_fields(sender, receiver, job):
+    return {
+        "sender_username": sender["username"] if sender else None,
+        "receiver_username": receiver["username"] if receiver else None,
+        "job_title": job["title"] if job else None,
+        "company_name": job.get("company_name") if job else None
+    }
+
+def sync_message_username(user_id, username):
+    messages_collection = get_messages_collection()
+    result = messages_collection.bulk_write([
+        UpdateMany({"sender_id": ObjectId(user_id)}, {"$set": {"sender_username": username}}),
+        UpdateMany({"receiver_id": ObjectId(user_id)}, {"$set": {"receiver_username": username}})
+    ], ordered=False)
+    invalidate_counts("messages")
+    # The inboxes of everyone this user wrote to show the new name
+    bump_listing_versions(inbox=messages_collection.distinct("receiver_id", {"sender_id": ObjectId(user_id)}))
+    return result
+
+def sync_message_job(job_id, job_title):
+    messages_collection = get_messages_collection()
+    result = messages_collection.bulk_write([
+        UpdateMany({"job_id": ObjectId(job_id)}, {"$set": {"job_title": job_title}})
+    ], ordered=False)
+    invalidate_counts("messages")
+    bump_listing_versions(inbox=messages_collection.distinct("receiver_id", {"job_id": ObjectId(job_id)}))
+    return result
+
+def backfill_message_fields(batch_size=500, resync=False):
+    # Walks the messages in _id order and rewrites their denormalized fields in
+    # batches. Only messages missing a field are touched unless `resync` is set.
+    # Yields the number of messages updated per batch.
+    messages_collection = get_messages_collection()
+    query = {} if resync else {"$or": [{field: {"$exists": False}} for field in MESSAGE_DENORMALIZED_FIELDS]}
+    projection = {"sender_id": 1, "receiver_id": 1, "job_id": 1}
+    last_id = None
+
+    while True:
+        batch_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        batch = list(messages_collection.find(batch_query, projection).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            return
+        last_id = batch[-1]["_id"]
+
+        loader = BatchLoader()
+        for message in batch:
+            loader.queue("users", message.get("sender_id"), message.get("receiver_id"))
+            loader.queue("jobs", message.get("job_id"))
+
+        operations = [
+            UpdateOne({"_id": message["_id"]}, {"$set": message_denormalized_fields(
+                loader.get("users", message.get("sender_id")),
+                loader.get("users", message.get("receiver_id")),
+                loader.get("jobs", message.get("job_id"))
+            )})
+            for message in batch
+        ]
+        result = messages_collection.bulk_write(operations, ordered=False)
+        invalidate_counts("messages")
+        bump_listing_versions(inbox=[message.get("receiver_id") for message in batch])
+        yield result.modified_count
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from app import bcrypt
+import logging
+import threading
+
+# Password hashing
+# bcrypt is slow on purpose, so hashing and checking run on a small pool of
+# BCRYPT_WORKERS threads. At most BCRYPT_QUEUE_LIMIT more can wait for a thread;
+# past that HashingBusy is raised right away (answered with a 503) instead of
+# letting login spikes tie up every request thread.
+
+logger = logging.getLogger(__name__)
+
+class HashingBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self.workers = None
+        self.queue_limit = None
+        self.rounds = 12
+        self.rejected = 0
+
+    def configure(self, workers, queue_limit, rounds):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+
+    def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(lambda: bcrypt.generate_password_hash(password, self.rounds).decode('utf-8'))
+
+    def check(self, password_hash, password):
+        return self._run(bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # Hashes look like $2b$<cost>$<salt and hash>
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def rehash_if_outdated(self, collection, document, password):
+        # Called after a successful login: stores a hash with the current cost.
+        # Only replaces the hash that was checked, in case the password changed meanwhile.
+        if not self.needs_rehash(document['password']):
+            return
+        try:
+            collection.update_one(
+                {"_id": document['_id'], "password": document['password']},
+                {"$set": {"password": self.hash(password)}}
+            )
+        except HashingBusy:
+            pass  # The next login tries again
+        except Exception as e:
+            logger.error("Could not rehash the password of %s: %s", document['_id'], e)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "rounds": self.rounds,
+            "rejected": self.rejected
+        }
+
+passwords = PasswordHasher()
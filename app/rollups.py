@@ -0,0 +1,237 @@
+from pymongo import UpdateOne, ASCENDING
+from app import mongo
+from app.cache import named_cache
+import datetime
+
+# Daily rollups
+# `daily_stats` holds one document per closed (UTC) day with the number of
+# signups, jobs posted, applications and messages created that day:
+#   {"_id": <midnight>, "signups": 3, "jobs_posted": 1, ..., "computed_at": <when>}
+# Reports add up these documents for the whole days of a range and only count
+# live for the rest (the current day and partial days at the edges).
+# Closed days are built once; documents deleted later are still counted on the
+# day they were created unless the rollups are rebuilt (`flask stats-rollup --resync`).
+
+# metric -> (collection, creation date field)
+ROLLUP_METRICS = {
+    "signups": ("users", "createdAt"),
+    "jobs_posted": ("jobs", "date_posted"),
+    "applications": ("job_applications", "date_applied"),
+    "messages": ("messages", "timestamp"),
+}
+
+ONE_DAY = datetime.timedelta(days=1)
+
+def get_daily_stats_collection():
+    if mongo.db is None:
+        raise RuntimeError("MongoDB not initialized")
+    return mongo.db.daily_stats
+
+def day_start(moment):
+    return datetime.datetime(moment.year, moment.month, moment.day)
+
+def today():
+    return day_start(datetime.datetime.utcnow())
+
+def count_live(metric, start, end):
+    collection_name, field = ROLLUP_METRICS[metric]
+    return mongo.db[collection_name].count_documents({field: {"$gte": start, "$lt": end}})
+
+_first_recorded_day = None
+
+def first_recorded_day():
+    # The earliest day any metric has data for, or None for an empty database.
+    # Documents are created with the current time, so once found it only moves
+    # later when the oldest documents are deleted, and is kept for the process.
+    global _first_recorded_day
+    if _first_recorded_day is None:
+        days = []
+        for collection_name, field in ROLLUP_METRICS.values():
+            first = mongo.db[collection_name].find_one({field: {"$ne": None}}, {field: 1}, sort=[(field, ASCENDING)])
+            if first is not None and isinstance(first.get(field), datetime.datetime):
+                days.append(day_start(first[field]))
+        _first_recorded_day = min(days) if days else None
+    return _first_recorded_day
+
+def build_days(days):
+    # Writes the daily_stats documents of `days` (midnights, ascending), with one
+    # grouped aggregation per metric from the first to the last of them. Returns
+    # the number of days written.
+    if not days:
+        return 0
+    since, until = days[0], days[-1] + ONE_DAY
+    counts = {day: {metric: 0 for metric in ROLLUP_METRICS} for day in days}
+
+    for metric, (collection_name, field) in ROLLUP_METRICS.items():
+        pipeline = [
+            {"$match": {field: {"$gte": since, "$lt": until}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$" + field}},
+                "count": {"$sum": 1}
+            }}
+        ]
+        for bucket in mongo.db[collection_name].aggregate(pipeline):
+            day = datetime.datetime.strptime(bucket["_id"], "%Y-%m-%d")
+            if day in counts:
+                counts[day][metric] = bucket["count"]
+
+    computed_at = datetime.datetime.utcnow()
+    get_daily_stats_collection().bulk_write([
+        UpdateOne({"_id": day}, {"$set": {**day_counts, "computed_at": computed_at}}, upsert=True)
+        for day, day_counts in counts.items()
+    ], ordered=False)
+    return len(counts)
+
+def days_between(since, until):
+    days = []
+    day = day_start(since)
+    while day < until:
+        days.append(day)
+        day += ONE_DAY
+    return days
+
+def build_rollups(since=None, resync=False):
+    # Builds the daily_stats documents of closed days, starting after the last
+    # built day (or at `since`). Returns the number of days written.
+    daily_stats = get_daily_stats_collection()
+    if since is None and not resync:
+        last = daily_stats.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        since = last["_id"] + ONE_DAY if last else None
+    if since is None:
+        since = first_recorded_day()
+    if since is None:
+        return 0
+    return build_days(days_between(since, today()))
+
+def rolled_up(metric, start, end):
+    # Sum of `metric` over the closed days [start, end). Days of the range without
+    # a rollup are built first, but none before the first recorded day: nothing
+    # was created then, so they count 0 without a document.
+    daily_stats = get_daily_stats_collection()
+    if daily_stats.count_documents({"_id": {"$gte": start, "$lt": end}}) < (end - start).days:
+        first = first_recorded_day()
+        if first is not None and max(start, first) < end:
+            since = max(start, first)
+            built = set(daily_stats.distinct("_id", {"_id": {"$gte": since, "$lt": end}}))
+            build_days([day for day in days_between(since, end) if day not in built])
+    result = list(daily_stats.aggregate([
+        {"$match": {"_id": {"$gte": start, "$lt": end}}},
+        {"$group": {"_id": None, "total": {"$sum": "$" + metric}}}
+    ]))
+    return result[0]["total"] if result else 0
+
+def count_between(metric, start, end):
+    # Number of `metric` events in [start, end): whole closed days come from
+    # daily_stats, partial days and the current day are counted live
+    if metric not in ROLLUP_METRICS:
+        raise ValueError("Unknown metric: " + metric)
+    first = day_start(start) if start == day_start(start) else day_start(start) + ONE_DAY
+    last = min(day_start(end), today())
+    if first >= last:
+        return count_live(metric, start, end)
+
+    total = rolled_up(metric, first, last)
+    if start < first:
+        total += count_live(metric, start, first)
+    if last < end:
+        total += count_live(metric, last, end)
+    return total
+
+# Histograms
+# Counts per hour, day, week (starting Monday) or month, from a single $dateTrunc
+# aggregation (MongoDB 5.0+). Buckets that are over and lie fully inside the
+# requested range can't change any more and are cached, so a chart that is
+# reloaded only queries the buckets it doesn't have yet.
+
+HISTOGRAM_BUCKETS = ('hour', 'day', 'week', 'month')
+
+histogram_cache = named_cache("histogram_buckets", maxsize=16384, ttl=86400)
+
+def bucket_floor(moment, unit):
+    if unit == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = day_start(moment)
+    if unit == 'day':
+        return day
+    if unit == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def bucket_next(bucket_start, unit):
+    if unit == 'hour':
+        return bucket_start + datetime.timedelta(hours=1)
+    if unit == 'day':
+        return bucket_start + ONE_DAY
+    if unit == 'week':
+        return bucket_start + datetime.timedelta(days=7)
+    if bucket_start.month == 12:
+        return bucket_start.replace(year=bucket_start.year + 1, month=1)
+    return bucket_start.replace(month=bucket_start.month + 1)
+
+# Width of the fixed-size buckets (months vary)
+BUCKET_WIDTHS = {
+    'hour': datetime.timedelta(hours=1),
+    'day': ONE_DAY,
+    'week': datetime.timedelta(days=7)
+}
+
+def histogram_bucket_count(start, end, unit):
+    # Number of buckets overlapping [start, end), without building them, so a
+    # range too wide for its bucket is rejected before anything is allocated
+    first = bucket_floor(start, unit)
+    if end <= first:
+        return 0
+    if unit in BUCKET_WIDTHS:
+        return -(-(end - first) // BUCKET_WIDTHS[unit])
+    last = bucket_floor(end, 'month')
+    months = (last.year - first.year) * 12 + last.month - first.month
+    return months + 1 if end > last else months
+
+def histogram_buckets(start, end, unit):
+    # (bucket start, bucket end) of every bucket overlapping [start, end)
+    buckets = []
+    bucket_start = bucket_floor(start, unit)
+    while bucket_start < end:
+        bucket_end = bucket_next(bucket_start, unit)
+        buckets.append((bucket_start, bucket_end))
+        bucket_start = bucket_end
+    return buckets
+
+def histogram(metric, start, end, unit):
+    # [(bucket start, count)] for [start, end), empty buckets included. The first and
+    # last buckets only count what falls inside the range.
+    if metric not in ROLLUP_METRICS:
+        raise ValueError("Unknown metric: " + metric)
+    if unit not in HISTOGRAM_BUCKETS:
+        raise ValueError("bucket must be one of: " + ", ".join(HISTOGRAM_BUCKETS))
+    collection_name, field = ROLLUP_METRICS[metric]
+    now = datetime.datetime.utcnow()
+
+    def closed(bucket_start, bucket_end):
+        return start <= bucket_start and bucket_end <= end and bucket_end <= now
+
+    counts = {}
+    missing = []
+    for bucket_start, bucket_end in histogram_buckets(start, end, unit):
+        count = histogram_cache.get((metric, unit, bucket_start)) if closed(bucket_start, bucket_end) else None
+        if count is None:
+            missing.append((bucket_start, bucket_end))
+        else:
+            counts[bucket_start] = count
+
+    if missing:
+        # One query covering every bucket that isn't cached
+        pipeline = [
+            {"$match": {field: {"$gte": max(start, missing[0][0]), "$lt": min(end, missing[-1][1])}}},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$" + field, "unit": unit, "startOfWeek": "monday"}},
+                "count": {"$sum": 1}
+            }}
+        ]
+        found = {bucket["_id"]: bucket["count"] for bucket in mongo.db[collection_name].aggregate(pipeline)}
+        for bucket_start, bucket_end in missing:
+            counts[bucket_start] = found.get(bucket_start, 0)
+            if closed(bucket_start, bucket_end):
+                histogram_cache.set((metric, unit, bucket_start), counts[bucket_start])
+
+    return sorted(counts.items())
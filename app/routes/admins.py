@@ -1,7 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
-from app import bcrypt
-from app.models import get_admin_by_email, get_admin_by_username, create_admin
+from app.passwords import passwords
+from app.models import get_admin_by_email, get_admin_by_username, create_admin, get_admins_collection
 from app.decorators import token_required_admin
+from app.cache import cache_stats
+from app.admission import admission_stats
+from app.events import hub
+from pymongo.errors import DuplicateKeyError
 import jwt
 import datetime
 
@@ -20,8 +24,11 @@ def signup_admin():
     if get_admin_by_email(email):
         return jsonify({'status': 'error', 'message': 'Admin with this email already exists'}), 400
 
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-    create_admin(username, email, hashed_password)
+    hashed_password = passwords.hash(password)
+    try:
+        create_admin(username, email, hashed_password)
+    except DuplicateKeyError:
+        return jsonify({'status': 'error', 'message': 'Admin with this username or email already exists'}), 400
 
     return jsonify({'status': 'success', 'message': 'Admin registered successfully'}), 201
 
@@ -39,8 +46,9 @@ def login_admin():
     if not admin:
         return jsonify({'status': 'error', 'message': 'Invalid username/email or password'}), 401
 
-    if not bcrypt.check_password_hash(admin['password'], password):
+    if not passwords.check(admin['password'], password):
         return jsonify({'status': 'error', 'message': 'Invalid username/email or password'}), 401
+    passwords.rehash_if_outdated(get_admins_collection(), admin, password)
 
     token = jwt.encode({
         'admin_id': str(admin['_id']),
@@ -49,3 +57,9 @@ def login_admin():
     }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
     return jsonify({'status': 'success', 'message': 'Login successful', 'token': token}), 200
+
+# In-process cache, password pool, admission and event stream counters for this worker
+@admins_bp.route('/stats', methods=['GET'])
+@token_required_admin
+def get_stats(current_admin):
+    return jsonify({'status': 'success', 'caches': cache_stats(), 'passwords': passwords.stats(), 'admission': admission_stats(), 'events': hub.stats()}), 200
@@ -1,11 +1,12 @@
 from flask import Blueprint, request, jsonify
-from app.models import get_companies_collection, get_user_by_id
+from app.models import get_companies_collection, get_user_by_id, get_company_by_id, invalidate_company, CollectionProxy
+from app.utils import conditional
 from app.decorators import token_required
 from bson.objectid import ObjectId
 import datetime
 
 companies_bp = Blueprint('companies', __name__)
-companies_collection = get_companies_collection()
+companies_collection = CollectionProxy(get_companies_collection)
 
 @companies_bp.route('/companies', methods=['POST'])
 @token_required
@@ -68,21 +69,27 @@ def update_company(current_user, company_id):
 
     try:
         # Perform the update
-        companies_collection.update_one({"_id": ObjectId(company_id)}, {"$set": update_data})
+        companies_collection.update_one({"_id": ObjectId(company_id)}, {"$set": update_data, "$inc": {"version": 1}})
+        invalidate_company(company_id)
         return jsonify({"status": "success", "message": "Company updated successfully"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# ETag source for a single company: its version, bumped by every update
+def company_version(company_id):
+    if not ObjectId.is_valid(company_id):
+        return None
+    company = get_company_by_id(company_id)
+    return (company.get('version', 0),) if company else None
+
 @companies_bp.route('/companies/<company_id>', methods=['GET'])
+@conditional(company_version, public=True)
 def get_company(company_id):
-    company = companies_collection.find_one({"_id": ObjectId(company_id)})
+    company = get_company_by_id(company_id)
 
     if not company:
         return jsonify({"status": "error", "message": "Company not found"}), 404
 
-    company['_id'] = str(company['_id'])
-    company['user_id'] = str(company['user_id'])
-
     return jsonify({"status": "success", "company": company}), 200
 
 @companies_bp.route('/companies/mine', methods=['GET'])
@@ -97,12 +104,12 @@ def get_my_company(current_user):
 
         # Format the company data to match the structure provided
         formatted_company = {
-            "_id": str(company["_id"]),
+            "_id": company["_id"],
             "title": company.get("title", ""),
             "about_us": company.get("about_us", ""),
             "number_of_employees": company.get("number_of_employees", ""),
             "founded_date": company.get("founded_date", ""),
-            "user_id": str(company["user_id"]),
+            "user_id": company["user_id"],
             "created_at": company["created_at"].isoformat() if company.get("created_at") else None
         }
 
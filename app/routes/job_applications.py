@@ -1,15 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from bson.objectid import ObjectId
-from app.models import get_jobs_collection, get_resumes_collection, get_job_applications_collection, get_user_by_id, get_messages_collection
+from app.models import get_jobs_collection, get_resumes_collection, get_job_applications_collection, get_messages_collection, get_loader, get_job_by_id, message_denormalized_fields, get_listing_version, bump_listing_versions, invalidate_counts, count_documents, change_unread_count, increment_unread_counts, CollectionProxy
 from app.decorators import token_required
+from app.events import publish_message
+from pymongo import UpdateOne
+from app.utils import keyset_filter, keyset_page, keyset_sort, conditional, get_count_strategy, stream_list
 import datetime
 
 # Initialize Blueprint and collections
 job_applications_bp = Blueprint('job_applications', __name__)
-job_applications_collection = get_job_applications_collection()
-jobs_collection = get_jobs_collection()
-resumes_collection = get_resumes_collection()
-messages_collection = get_messages_collection()
+job_applications_collection = CollectionProxy(get_job_applications_collection)
+jobs_collection = CollectionProxy(get_jobs_collection)
+resumes_collection = CollectionProxy(get_resumes_collection)
+messages_collection = CollectionProxy(get_messages_collection)
 
 # Define the helper function
 def get_job_application_by_id(application_id):
@@ -32,11 +35,11 @@ def apply_for_job(current_user):
     if not all(field in data for field in required_fields):
         return jsonify({"status": "error", "error": "Missing fields"}), 400
 
-    job = jobs_collection.find_one({"_id": ObjectId(data['job_id'])})
+    job = jobs_collection.find_one({"_id": ObjectId(data['job_id'])}, {"_id": 1})
     if not job:
         return jsonify({"status": "error", "error": "Job not found"}), 404
 
-    resume = resumes_collection.find_one({"user_id": ObjectId(current_user)})
+    resume = resumes_collection.find_one({"user_id": ObjectId(current_user)}, {"_id": 1})
     if not resume:
         return jsonify({"status": "error", "error": "Resume not found"}), 404
 
@@ -50,17 +53,63 @@ def apply_for_job(current_user):
 
     try:
         job_applications_collection.insert_one(application)
+        invalidate_counts("job_applications")
+        bump_listing_versions(my_applications=[application["user_id"]], job_applications=[application["job_id"]])
         return jsonify({"status": "success", "message": "Job application submitted successfully"}), 201
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
 
+# Pipeline stages that select one page of applications.
+# Returns (stages, counter_start, position); position is None unless `after` is used.
+def application_page_stages(application_filter, page_size, current_page, after):
+    if after is not None:
+        # Keyset pagination, newest applications first
+        keyset_query, position = keyset_filter(application_filter, 'date_applied', after)
+        stages = [
+            {"$match": keyset_query},
+            {"$sort": dict(keyset_sort('date_applied'))},
+            {"$limit": page_size + 1}
+        ]
+        return stages, position + 1, position
+    if current_page == 0:
+        return [{"$match": application_filter}], 1 - page_size, None
+    stages = [
+        {"$match": application_filter},
+        {"$skip": page_size * (current_page - 1)},
+        {"$limit": page_size}
+    ]
+    return stages, (current_page - 1) * page_size + 1, None
+
+# $lookup stage joining a single document by _id, keeping only `fields`
+def lookup_by_id(collection_name, local_field, fields, as_field):
+    return {"$lookup": {
+        "from": collection_name,
+        "let": {"lookup_id": "$" + local_field},
+        "pipeline": [
+            {"$match": {"$expr": {"$eq": ["$_id", "$$lookup_id"]}}},
+            {"$project": {field: 1 for field in fields}}
+        ],
+        "as": as_field
+    }}
+
+# ETag source for the applications to a job, for its poster only: everyone else
+# gets the route's 404/403 without a version being read
+def job_applications_version(current_user, job_id):
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = get_job_by_id(job_id)
+    if not job or str(job.get('posted_by', {}).get('user_id')) != current_user:
+        return None
+    return get_listing_version("job_applications", job_id)
+
 # Get Applications for a Job (Employer)
 @job_applications_bp.route('/applications/<job_id>', methods=['GET'])
 @token_required
+@conditional(job_applications_version)
 def get_applications_for_job(current_user, job_id):
     try:
         # Retrieve the job document
-        job = jobs_collection.find_one({"_id": ObjectId(job_id)})
+        job = jobs_collection.find_one({"_id": ObjectId(job_id)}, {"posted_by.user_id": 1})
         
         if not job:
             return jsonify({"status": "error", "message": "Job not found"}), 404
@@ -73,39 +122,51 @@ def get_applications_for_job(current_user, job_id):
         # Pagination parameters
         page_size = int(request.args.get('page_size', 10))
         current_page = int(request.args.get('current_page', 1))
+        after = request.args.get('after')
 
-        # Fetch applications with pagination
-        total_count = job_applications_collection.count_documents({"job_id": ObjectId(job_id)})
-        query = job_applications_collection.find({"job_id": ObjectId(job_id)})
-        
-        if current_page == 0:
-            applications = list(query)
-        else:
-            applications = list(query.skip(page_size * (current_page - 1)).limit(page_size))
-
-        application_list = []
-        # Start counter based on the current page and page size
-        counter_start = (current_page - 1) * page_size + 1
-
-        for index, application in enumerate(applications):
-            user = get_user_by_id(application["user_id"])
-            application_list.append({
-                "counter": counter_start + index,  # Counter value
-                "application_id": str(application["_id"]),  # Include application ID
-                "user_id": str(application["user_id"]),  # Include user ID
-                "job_id": str(application["job_id"]),  # Include job ID
-                "username": user.get("username", "Unknown"),  # Assuming 'username' is a field in user document
+        application_filter = {"job_id": ObjectId(job_id)}
+        try:
+            total_count = count_documents(job_applications_collection, application_filter, get_count_strategy(request.args))
+            stages, counter_start, position = application_page_stages(application_filter, page_size, current_page, after)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        # One round trip: the page of applications joined with the applicants' usernames
+        pipeline = stages + [lookup_by_id("users", "user_id", ["username"], "user")]
+        applications = job_applications_collection.aggregate(pipeline, batchSize=current_app.config['STREAM_BATCH_SIZE'])
+
+        next_cursor = None
+        if position is not None:
+            applications, next_cursor = keyset_page(list(applications), 'date_applied', page_size, position)
+
+        def serialize(application, counter):
+            user = application["user"][0] if application["user"] else {}
+            return {
+                "counter": counter,  # Counter value
+                "application_id": application["_id"],  # Include application ID
+                "user_id": application["user_id"],  # Include user ID
+                "job_id": application["job_id"],  # Include job ID
+                "username": user.get("username", "Unknown"),
                 "date_applied": application["date_applied"].isoformat(),  # Convert to ISO format for consistency
                 "status": application["status"]
-            })
+            }
+        rows = (serialize(application, index) for index, application in enumerate(applications, start=counter_start))
 
-        return jsonify({
+        response = {
             "status": "success",
             "total_count": total_count,
             "page_size": page_size,
-            "current_page": current_page,
-            "applications": application_list
-        }), 200
+            "current_page": current_page
+        }
+        if current_page == 0 and after is None:
+            # Every application, streamed
+            return stream_list(response, "applications", rows)
+
+        response["applications"] = list(rows)
+        if after is not None:
+            response["current_page"] = None
+            response["next_cursor"] = next_cursor
+        return jsonify(response), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -113,50 +174,80 @@ def get_applications_for_job(current_user, job_id):
 # Get My Applications with Pagination and Messages
 @job_applications_bp.route('/my-applications', methods=['GET'])
 @token_required
+@conditional(lambda current_user: get_listing_version("my_applications", current_user))
 def get_my_applications(current_user):
     # Pagination parameters
     page_size = int(request.args.get('page_size', 10))
     current_page = int(request.args.get('current_page', 1))
+    after = request.args.get('after')
 
-    # Fetch applications with pagination
-    total_count = job_applications_collection.count_documents({"user_id": ObjectId(current_user)})
-    query = job_applications_collection.find({"user_id": ObjectId(current_user)})
-    
-    if current_page == 0:
-        applications = list(query)
-    else:
-        applications = list(query.skip(page_size * (current_page - 1)).limit(page_size))
-
-    applied_jobs = []
-    for index, application in enumerate(applications, start=(current_page - 1) * page_size + 1):
-        job = jobs_collection.find_one({"_id": application["job_id"]})
-        if job:
-            messages = list(messages_collection.find({"application_id": application["_id"]}))
-            applied_jobs.append({
-                "counter": index,
-                "application_id": str(application["_id"]),
-                "job_id": str(job["_id"]),
-                "job_title": job["title"],
-                "company_name": job.get("company_name", "N/A"),
-                "location": job["location"],
-                "date_applied": application["date_applied"].isoformat(),
-                "status": application["status"],  # Include the status
-                "messages": [
-                    {
-                        "sender_id": str(message["sender_id"]),
-                        "message": message["message"],
-                        "status": message["status"],
-                        "timestamp": message["timestamp"].isoformat()
-                    } for message in messages
-                ]  # Include the messages
-            })
-    
-    return jsonify({
+    application_filter = {"user_id": ObjectId(current_user)}
+    try:
+        total_count = count_documents(job_applications_collection, application_filter, get_count_strategy(request.args))
+        stages, counter_start, position = application_page_stages(application_filter, page_size, current_page, after)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    # One round trip: the page of applications joined with their job and messages
+    pipeline = stages + [
+        lookup_by_id("jobs", "job_id", ["title", "company_name", "location"], "job"),
+        {"$lookup": {
+            "from": "messages",
+            "let": {"application_id": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$application_id", "$$application_id"]}}},
+                {"$project": {"sender_id": 1, "message": 1, "status": 1, "timestamp": 1}}
+            ],
+            "as": "messages"
+        }}
+    ]
+    applications = job_applications_collection.aggregate(pipeline, batchSize=current_app.config['STREAM_BATCH_SIZE'])
+
+    next_cursor = None
+    if position is not None:
+        applications, next_cursor = keyset_page(list(applications), 'date_applied', page_size, position)
+
+    def serialize(application, counter):
+        job = application["job"][0]
+        return {
+            "counter": counter,
+            "application_id": application["_id"],
+            "job_id": job["_id"],
+            "job_title": job["title"],
+            "company_name": job.get("company_name", "N/A"),
+            "location": job["location"],
+            "date_applied": application["date_applied"].isoformat(),
+            "status": application["status"],  # Include the status
+            "messages": [
+                {
+                    "sender_id": message["sender_id"],
+                    "message": message["message"],
+                    "status": message["status"],
+                    "timestamp": message["timestamp"].isoformat()
+                } for message in application["messages"]
+            ]  # Include the messages
+        }
+    # Applications whose job was deleted are left out, as before
+    rows = (
+        serialize(application, index)
+        for index, application in enumerate(applications, start=counter_start)
+        if application["job"]
+    )
+
+    response = {
         "total_count": total_count,
         "page_size": page_size,
-        "current_page": current_page,
-        "applied_jobs": applied_jobs
-    }), 200
+        "current_page": current_page
+    }
+    if current_page == 0 and after is None:
+        # Every application, streamed
+        return stream_list(response, "applied_jobs", rows)
+
+    response["applied_jobs"] = list(rows)
+    if after is not None:
+        response["current_page"] = None
+        response["next_cursor"] = next_cursor
+    return jsonify(response), 200
 
 from bson.objectid import ObjectId
 
@@ -183,12 +274,14 @@ def update_application_status(current_user, application_id):
 
     try:
         # Update the application status
+        now = datetime.datetime.utcnow()
         job_applications_collection.update_one(
             {"_id": ObjectId(application_id)},
             {"$set": {"status": data['status']}}
         )
 
-        # Add a message to the messages collection
+        # Add a message to the messages collection, with the names it is displayed with
+        loader = get_loader().queue("users", current_user, application['user_id'])
         message_data = {
             "application_id": application['_id'],
             "job_id": application['job_id'],
@@ -197,15 +290,122 @@ def update_application_status(current_user, application_id):
             "message": data['message'],
             "status": data['status'],
             "read_status": "unread",  # Default to unread
-            "timestamp": datetime.datetime.utcnow()
+            "timestamp": now,
+            **message_denormalized_fields(
+                loader.get("users", current_user),
+                loader.get("users", application['user_id']),
+                job
+            )
         }
         messages_collection.insert_one(message_data)
+        change_unread_count(application['user_id'], 1)
+        invalidate_counts("job_applications")
+        invalidate_counts("messages")
+        bump_listing_versions(my_applications=[application['user_id']], job_applications=[application['job_id']],
+                              inbox=[application['user_id']])
+        publish_message(message_data)
 
         return jsonify({"status": "success", "message": "Application status updated successfully"}), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Most items accepted by one bulk request
+MAX_BULK_ITEMS = 500
+
+# Update the status of several applications at once (Employer):
+# {"updates": [{"application_id": ..., "status": ..., "message": ...}, ...]}
+# Ownership is checked for all of them with one query, then the applications are
+# updated with one bulk_write and the messages added with one insert_many.
+# Returns a result per item, in order.
+@job_applications_bp.route('/applications/status', methods=['PATCH'])
+@token_required
+def update_application_statuses(current_user):
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+
+    if not isinstance(updates, list) or not all(isinstance(item, dict) for item in updates):
+        return jsonify({"status": "error", "error": "updates must be a list of {application_id, status, message}"}), 400
+    if len(updates) > MAX_BULK_ITEMS:
+        return jsonify({"status": "error", "error": f"At most {MAX_BULK_ITEMS} updates per request"}), 400
+
+    results = [{"application_id": item.get('application_id')} for item in updates]
+    application_ids = set()
+    for item, result in zip(updates, results):
+        if 'status' not in item or 'message' not in item:
+            result["error"] = "Missing status or message"
+        elif not isinstance(item.get('application_id'), str) or not ObjectId.is_valid(item['application_id']):
+            result["error"] = "Invalid application id"
+        else:
+            application_ids.add(ObjectId(item['application_id']))
+
+    try:
+        applications = {
+            application["_id"]: application
+            for application in job_applications_collection.find(
+                {"_id": {"$in": list(application_ids)}}, {"job_id": 1, "user_id": 1})
+        }
+        # Only the caller's jobs come back, which is the ownership check
+        jobs = {
+            job["_id"]: job
+            for job in jobs_collection.find(
+                {"_id": {"$in": list({application["job_id"] for application in applications.values()})},
+                 "posted_by.user_id": ObjectId(current_user)},
+                {"title": 1, "company_name": 1})
+        }
+
+        loader = get_loader().queue("users", current_user, *(application["user_id"] for application in applications.values()))
+        sender = loader.get("users", current_user)
+        now = datetime.datetime.utcnow()
+        operations = []
+        messages = []
+        for item, result in zip(updates, results):
+            if "error" in result:
+                continue
+            application = applications.get(ObjectId(item['application_id']))
+            if application is None:
+                result["error"] = "Application not found"
+                continue
+            job = jobs.get(application["job_id"])
+            if job is None:
+                result["error"] = "Unauthorized"
+                continue
+
+            operations.append(UpdateOne({"_id": application["_id"]}, {"$set": {"status": item['status']}}))
+            messages.append({
+                "application_id": application["_id"],
+                "job_id": application["job_id"],
+                "sender_id": ObjectId(current_user),
+                "receiver_id": application["user_id"],
+                "message": item['message'],
+                "status": item['status'],
+                "read_status": "unread",
+                "timestamp": now,
+                **message_denormalized_fields(sender, loader.get("users", application["user_id"]), job)
+            })
+            result["status"] = item['status']
+
+        if operations:
+            job_applications_collection.bulk_write(operations, ordered=False)
+            messages_collection.insert_many(messages, ordered=False)
+            unread = {}
+            for message in messages:
+                unread[message["receiver_id"]] = unread.get(message["receiver_id"], 0) + 1
+            increment_unread_counts(unread)
+            invalidate_counts("job_applications")
+            invalidate_counts("messages")
+            bump_listing_versions(my_applications=unread, inbox=unread,
+                                  job_applications=[message["job_id"] for message in messages])
+            for message in messages:
+                publish_message(message)
+
+        for result in results:
+            result["result"] = "error" if "error" in result else "updated"
+        return jsonify({"status": "success", "updated": len(operations), "results": results}), 200
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # Delete a Job Application
 @job_applications_bp.route('/applications/<application_id>', methods=['DELETE'])
 @token_required
@@ -219,6 +419,8 @@ def delete_job_application(current_user, application_id):
 
     try:
         job_applications_collection.delete_one({"_id": ObjectId(application_id)})
+        invalidate_counts("job_applications")
+        bump_listing_versions(my_applications=[application['user_id']], job_applications=[application['job_id']])
         return jsonify({"message": "Job application deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
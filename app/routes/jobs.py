@@ -1,44 +1,41 @@
-from flask import Blueprint, request, jsonify
-from app.models import get_jobs_collection, get_user_by_id, get_job_applications_collection, get_company_by_id, get_companies_collection
+from flask import Blueprint, request, jsonify, current_app
+from app.models import get_jobs_collection, get_user_by_id, get_job_applications_collection, get_company_by_id, get_companies_collection, sync_message_job, get_job_by_id as find_job_by_id, invalidate_job, record_job_deletion, get_collection_versions, bump_collection_version, get_listing_version, bump_listing_versions, count_documents, CollectionProxy
 from app.decorators import token_required
+from app.utils import keyset_filter, keyset_page, keyset_sort, conditional, get_count_strategy, stream_list, iter_batches, requested_fields, fields_projection, select_fields
+from app.search import get_job_search
+from app.cache import named_cache
 from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
 import datetime
+import codecs
+import csv
+import json
+import math
 
 jobs_bp = Blueprint('jobs', __name__)
-jobs_collection = get_jobs_collection()
-job_applications_collection = get_job_applications_collection()
+jobs_collection = CollectionProxy(get_jobs_collection)
+job_applications_collection = CollectionProxy(get_job_applications_collection)
 
-@jobs_bp.route('/jobs', methods=['POST'])
-@token_required
-def add_job(current_user):
-    data = request.get_json()
-    
-    # Required fields
-    required_fields = ('title', 'sector', 'salary', 'location', 'job_type')
-    
-    # Check for missing required fields
-    if not all(key in data and data[key] for key in required_fields):
-        return jsonify({"status": "error", "error": "Missing required fields"}), 400
+# Facet counts per normalized filter set, kept for JOB_FACETS_CACHE_SECONDS
+facets_cache = named_cache('job_facets', maxsize=512)
 
-    user = get_user_by_id(current_user)
-    if user is None:
-        return jsonify({"status": "error", "error": "User not found"}), 404
+# Required fields of a new job
+JOB_REQUIRED_FIELDS = ('title', 'sector', 'salary', 'location', 'job_type')
 
-    # Retrieve the company associated with the user
-    companies_collection = get_companies_collection()
-    company = companies_collection.find_one({"user_id": ObjectId(current_user)})
+def missing_job_fields(data):
+    return [key for key in JOB_REQUIRED_FIELDS if not data.get(key)]
 
-    if company:
-        company_id = company['_id']
-        company_name = company['title']
-    else:
-        company_id = None
-        company_name = None
+# The company a user posts jobs for, or None
+def find_poster_company(user_id):
+    companies_collection = get_companies_collection()
+    return companies_collection.find_one({"user_id": ObjectId(user_id)}, {"title": 1})
 
-    # Prepare the job document with required and optional fields
-    job = {
+# Prepare the job document with required and optional fields
+def new_job(data, user_id, company, now):
+    return {
         "title": data['title'],
-        "date_posted": datetime.datetime.utcnow(),
+        "date_posted": now,
+        "updated_at": now,
         "sector": data['sector'],
         "salary": data['salary'],
         "location": data['location'],
@@ -47,54 +44,384 @@ def add_job(current_user):
         "description": data.get('description'),  # Optional
         "benefits": data.get('benefits'),  # Optional
         "posted_by": {
-            "user_id": ObjectId(current_user),
-            "company_id": company_id
+            "user_id": ObjectId(user_id),
+            "company_id": company['_id'] if company else None
         },
-        "company_name": company_name
+        "company_name": company['title'] if company else None
     }
 
+@jobs_bp.route('/jobs', methods=['POST'])
+@token_required
+def add_job(current_user):
+    data = request.get_json()
+    
+    # Check for missing required fields
+    if missing_job_fields(data):
+        return jsonify({"status": "error", "error": "Missing required fields"}), 400
+
+    user = get_user_by_id(current_user)
+    if user is None:
+        return jsonify({"status": "error", "error": "User not found"}), 404
+
+    # Retrieve the company associated with the user
+    company = find_poster_company(current_user)
+    job = new_job(data, current_user, company, datetime.datetime.utcnow())
+
     try:
         jobs_collection.insert_one(job)
+        bump_collection_version("jobs")
+        bump_listing_versions(my_jobs=[current_user])
+        job_search = get_job_search()
+        if job_search is not None:
+            job_search.add(job)
         return jsonify({"status": "success", "message": "Job posted successfully"}), 201
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
 
-@jobs_bp.route('/jobs', methods=['GET'])
-def get_jobs():
-    page_size = int(request.args.get('page_size', 10))  # Default page size is 10
-    current_page = int(request.args.get('current_page', 1))  # Default to the first page
+# Bulk import
+# POST /jobs/jobs/import takes one job per line, as NDJSON (application/x-ndjson)
+# or CSV with a header row (text/csv), or ?format=ndjson|csv. The body is read as
+# a stream and written in batches of JOB_IMPORT_BATCH_SIZE, so uploads of any size
+# use the same memory. Lines that fail are reported by line number and don't stop
+# the others.
+JOB_IMPORT_FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv"
+}
+
+def import_format():
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt if fmt in ('ndjson', 'csv') else None
+    return JOB_IMPORT_FORMATS.get(request.mimetype)
+
+def body_lines():
+    # The request body as text lines, read as they arrive
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for line in request.stream:
+        yield decoder.decode(line)
+
+# NaN and infinities are refused (ValueError) wherever the import reads numbers:
+# stored, they break range filters and sorting, and can't be written back as JSON
+def finite_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("Not a finite number: " + value)
+    return number
+
+def reject_constant(name):
+    raise ValueError("Not a finite number: " + name)
+
+def csv_value(value):
+    # CSV cells are text; salaries that are numbers are stored as numbers like in JSON
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        float(value)
+    except ValueError:
+        return value
+    return finite_float(value)
+
+def import_rows(fmt):
+    # Yields (line number, job data or None, error or None)
+    if fmt == 'csv':
+        reader = csv.DictReader(body_lines())
+        try:
+            for row in reader:
+                data = {key.strip(): value for key, value in row.items() if key and value not in (None, '')}
+                if 'salary' in data:
+                    try:
+                        data['salary'] = csv_value(data['salary'])
+                    except ValueError as e:
+                        yield reader.line_num, None, "Invalid salary: " + str(e)
+                        continue
+                yield reader.line_num, data, None
+        except csv.Error as e:
+            yield reader.line_num, None, "Invalid CSV: " + str(e)
+        return
+
+    for number, line in enumerate(body_lines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line, parse_float=finite_float, parse_constant=reject_constant)
+        except ValueError as e:
+            yield number, None, "Invalid JSON: " + str(e)
+            continue
+        if not isinstance(data, dict):
+            yield number, None, "Each line must be a JSON object"
+            continue
+        yield number, data, None
+
+@jobs_bp.route('/jobs/import', methods=['POST'])
+@token_required
+def import_jobs(current_user):
+    fmt = import_format()
+    if fmt is None:
+        return jsonify({"status": "error", "error": "Send NDJSON (application/x-ndjson) or CSV (text/csv)"}), 415
 
-    query = jobs_collection.find()
-    total_count = jobs_collection.count_documents({})  # Count total documents
+    user = get_user_by_id(current_user)
+    if user is None:
+        return jsonify({"status": "error", "error": "User not found"}), 404
+
+    # Looked up once for the whole upload
+    company = find_poster_company(current_user)
+    batch_size = current_app.config['JOB_IMPORT_BATCH_SIZE']
+    max_errors = current_app.config['JOB_IMPORT_MAX_ERRORS']
+    job_search = get_job_search()
+
+    inserted = 0
+    failed = 0
+    errors = []
+
+    def fail(number, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({"line": number, "error": error})
+
+    def write(batch):
+        # batch: [(line number, job)]
+        nonlocal inserted
+        jobs = [job for _, job in batch]
+        try:
+            jobs_collection.insert_many(jobs, ordered=False)
+            written = jobs
+        except BulkWriteError as e:
+            rejected = {}
+            for write_error in e.details.get('writeErrors', []):
+                rejected[write_error['index']] = write_error.get('errmsg', "Write failed")
+            for index, message in rejected.items():
+                fail(batch[index][0], message)
+            written = [job for index, job in enumerate(jobs) if index not in rejected]
+        inserted += len(written)
+        if job_search is not None:
+            for job in written:
+                job_search.add(job)
+
+    batch = []
+    now = datetime.datetime.utcnow()
+    for number, data, error in import_rows(fmt):
+        if error is None:
+            missing = missing_job_fields(data)
+            if missing:
+                error = "Missing required fields: " + ", ".join(missing)
+        if error is not None:
+            fail(number, error)
+            continue
+        batch.append((number, new_job(data, current_user, company, now)))
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+
+    if inserted:
+        bump_collection_version("jobs")
+        bump_listing_versions(my_jobs=[current_user])
+
+    return jsonify({
+        "status": "success",
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors)
+    }), 200
 
-    if current_page == 0:
-        jobs = list(query)
+# Fields that can be filtered on with an exact match, e.g. /jobs/jobs?sector=IT
+JOB_FILTER_FIELDS = ('sector', 'location', 'job_type', 'company_name')
+JOB_SORTS = ('newest', 'relevance')
+
+# Fields that can be picked with ?fields=, and named sets of them
+JOB_FIELDS = ('title', 'date_posted', 'updated_at', 'sector', 'salary', 'location', 'job_type',
+              'requirements', 'description', 'benefits', 'posted_by', 'company_name')
+JOB_FIELD_PRESETS = {
+    # What the job list shows
+    "summary": ('title', 'company_name', 'location', 'salary', 'job_type', 'date_posted')
+}
+
+# Builds the Mongo filter for the search parameters of the job listing.
+# `q` is a keyword search over title, description and requirements (text index).
+def job_search_filter(args):
+    job_filter = {}
+    keyword = (args.get('q') or '').strip()
+    if keyword:
+        job_filter['$text'] = {"$search": keyword}
+    for field in JOB_FILTER_FIELDS:
+        value = args.get(field)
+        if value:
+            job_filter[field] = value
+    return job_filter
+
+# Shared by the job list endpoints.
+# `current_page` pages with skip/limit (0 returns everything); passing `after`
+# (empty for the first page) switches to keyset pagination, newest first.
+# `sort` is `newest` or `relevance` (keyword searches only); without it keyword
+# searches are ranked by relevance and everything else keeps natural order.
+# `fields` limits the fields of each job, see JOB_FIELDS and JOB_FIELD_PRESETS.
+def list_jobs(job_filter):
+    page_size = int(request.args.get('page_size', 10))  # Default page size is 10
+    current_page = int(request.args.get('current_page', 1))  # Default to the first page
+    after = request.args.get('after')
+    sort = request.args.get('sort') or ('relevance' if '$text' in job_filter else None)
+
+    if sort is not None and sort not in JOB_SORTS:
+        return jsonify({"status": "error", "error": "sort must be one of: " + ", ".join(JOB_SORTS)}), 400
+    if sort == 'relevance' and '$text' not in job_filter:
+        return jsonify({"status": "error", "error": "sort=relevance requires a keyword (q)"}), 400
+    if sort == 'relevance' and after is not None:
+        return jsonify({"status": "error", "error": "Cursor pagination only supports sort=newest"}), 400
+    try:
+        count_strategy = get_count_strategy(request.args)
+        fields = requested_fields(request.args, JOB_FIELDS, JOB_FIELD_PRESETS)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    projection = fields_projection(fields)
+
+    # Relevance-ranked searches on the public filters can be answered by the in-memory index
+    job_search = get_job_search() if sort == 'relevance' and after is None else None
+    if job_search is not None and not set(job_filter) <= {'$text', *JOB_FILTER_FIELDS}:
+        job_search = None
+
+    total_count = None  # The in-memory index counts its own matches
+    if job_search is None:
+        total_count = count_documents(jobs_collection, job_filter, count_strategy)  # Count total documents
+    next_cursor = None
+
+    if after is not None:
+        try:
+            keyset_query, position = keyset_filter(job_filter, 'date_posted', after)
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+        query = jobs_collection.find(keyset_query, fields_projection(fields, 'date_posted'))
+        jobs, next_cursor = keyset_page(list(query.sort(keyset_sort('date_posted')).limit(page_size + 1)), 'date_posted', page_size, position)
+        jobs = [select_fields(job, fields, '_id') for job in jobs]  # date_posted was only read for the cursor
+        counter_start = position + 1
+    elif job_search is not None:
+        # Ranked by the in-memory index; Mongo only loads the jobs on the page
+        filters = {field: value for field, value in job_filter.items() if field != '$text'}
+        if current_page == 0:
+            total_count, job_ids = job_search.search(job_filter['$text']['$search'], filters, 0, None)
+            counter_start = 1 - page_size
+        else:
+            offset = page_size * (current_page - 1)
+            total_count, job_ids = job_search.search(job_filter['$text']['$search'], filters, offset, page_size)
+            counter_start = offset + 1
+        jobs = load_jobs_in_order(job_ids, projection)
     else:
-        jobs = list(query.skip(page_size * (current_page - 1)).limit(page_size))
+        if sort == 'relevance':
+            text_score = {"$meta": "textScore"}
+            query = jobs_collection.find(job_filter, {**(projection or {}), "score": text_score}).sort([("score", text_score)])
+        elif sort == 'newest':
+            query = jobs_collection.find(job_filter, projection).sort(keyset_sort('date_posted'))
+        else:
+            query = jobs_collection.find(job_filter, projection)
 
-    for index, job in enumerate(jobs, start=(current_page - 1) * page_size + 1):
-        job['_id'] = str(job['_id'])
-        job['posted_by']['user_id'] = str(job['posted_by']['user_id'])
-        job['posted_by']['company_id'] = str(job['posted_by']['company_id'])
-        job['counter'] = index
+        if current_page == 0:
+            jobs = query.batch_size(current_app.config['STREAM_BATCH_SIZE'])
+            counter_start = 1 - page_size
+        else:
+            jobs = query.skip(page_size * (current_page - 1)).limit(page_size)
+            counter_start = (current_page - 1) * page_size + 1
 
-    return jsonify({
+    response = {
         "total_count": total_count,
         "page_size": page_size,
-        "current_page": current_page,
-        "jobs": jobs
-    }), 200
+        "current_page": current_page
+    }
+    rows = (serialize_job(job, index) for index, job in enumerate(jobs, start=counter_start))
+
+    if current_page == 0 and after is None:
+        # Everything: streamed, so the whole collection never has to fit in memory
+        return stream_list(response, "jobs", rows)
+
+    response["jobs"] = list(rows)
+    if after is not None:
+        response["current_page"] = None
+        response["next_cursor"] = next_cursor
+    return jsonify(response), 200
+
+def serialize_job(job, counter):
+    job.pop('score', None)
+    job['counter'] = counter
+    return job
+
+# Loads jobs by id, in batches, in the order of `job_ids`
+def load_jobs_in_order(job_ids, projection=None):
+    for batch_ids in iter_batches(job_ids, current_app.config['STREAM_BATCH_SIZE']):
+        found = {job['_id']: job for job in jobs_collection.find({"_id": {"$in": batch_ids}}, projection)}
+        for job_id in batch_ids:
+            if job_id in found:
+                yield found[job_id]
+
+# Supports ?q=<keywords>&sector=&location=&job_type=&company_name=&sort=newest|relevance&fields=
+@jobs_bp.route('/jobs', methods=['GET'])
+@conditional(lambda: get_collection_versions("jobs"), public=True)
+def get_jobs():
+    return list_jobs(job_search_filter(request.args))
+
+# Counts per sector, job_type, location and company_name for the listing sidebar.
+# Takes the same search parameters as GET /jobs/jobs.
+@jobs_bp.route('/jobs/facets', methods=['GET'])
+@conditional(lambda: get_collection_versions("jobs"), public=True)
+def get_job_facets():
+    job_filter = job_search_filter(request.args)
+
+    # Keyword search is case-insensitive, so case and spacing of q don't change the result
+    keyword = " ".join(job_filter['$text']['$search'].lower().split()) if '$text' in job_filter else None
+    cache_key = (keyword,) + tuple(job_filter.get(field) for field in JOB_FILTER_FIELDS)
+    facets = facets_cache.get(cache_key)
+
+    if facets is None:
+        try:
+            pipeline = [
+                {"$match": job_filter},
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    **{
+                        field: [
+                            {"$group": {"_id": "$" + field, "count": {"$sum": 1}}},
+                            {"$sort": {"count": -1, "_id": 1}}
+                        ] for field in JOB_FILTER_FIELDS
+                    }
+                }}
+            ]
+            result = next(jobs_collection.aggregate(pipeline))
+        except Exception as e:
+            return jsonify({"status": "error", "error": str(e)}), 500
+
+        facets = {
+            "total_count": result["total"][0]["count"] if result["total"] else 0,
+            "facets": {
+                field: [{"value": bucket["_id"], "count": bucket["count"]} for bucket in result[field]]
+                for field in JOB_FILTER_FIELDS
+            }
+        }
+        facets_cache.set(cache_key, facets, ttl=current_app.config['JOB_FACETS_CACHE_SECONDS'])
+
+    return jsonify({"status": "success", **facets}), 200
+
+# ETag source for a single job: its version, bumped by every update
+def job_version(job_id):
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = find_job_by_id(job_id)
+    return (job.get('version', 0),) if job else None
 
 @jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+@conditional(job_version, public=True)
 def get_job_by_id(job_id):
     try:
-        job = jobs_collection.find_one({"_id": ObjectId(job_id)})
+        fields = requested_fields(request.args, JOB_FIELDS, JOB_FIELD_PRESETS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        job = find_job_by_id(job_id)
         if job:
-            # Convert ObjectId to string for JSON serialization
-            job['_id'] = str(job['_id'])
-            job['posted_by']['user_id'] = str(job['posted_by']['user_id'])
-            job['posted_by']['company_id'] = str(job['posted_by']['company_id'])
-            return jsonify(job), 200
+            return jsonify(select_fields(job, fields, '_id')), 200
         else:
             return jsonify({"error": "Job not found"}), 404
     except Exception as e:
@@ -102,30 +429,9 @@ def get_job_by_id(job_id):
 
 @jobs_bp.route('/jobs/mine', methods=['GET'])
 @token_required
+@conditional(lambda current_user: get_listing_version("my_jobs", current_user))
 def get_my_jobs(current_user):
-    page_size = int(request.args.get('page_size', 10))  # Default page size is 10
-    current_page = int(request.args.get('current_page', 1))  # Default to the first page
-
-    query = jobs_collection.find({"posted_by.user_id": ObjectId(current_user)})
-    total_count = jobs_collection.count_documents({"posted_by.user_id": ObjectId(current_user)})
-
-    if current_page == 0:
-        jobs = list(query)
-    else:
-        jobs = list(query.skip(page_size * (current_page - 1)).limit(page_size))
-
-    for index, job in enumerate(jobs, start=(current_page - 1) * page_size + 1):
-        job['_id'] = str(job['_id'])
-        job['posted_by']['user_id'] = str(job['posted_by']['user_id'])
-        job['posted_by']['company_id'] = str(job['posted_by']['company_id'])
-        job['counter'] = index
-
-    return jsonify({
-        "total_count": total_count,
-        "page_size": page_size,
-        "current_page": current_page,
-        "jobs": jobs
-    }), 200
+    return list_jobs({"posted_by.user_id": ObjectId(current_user)})
 
 @jobs_bp.route('/jobs/<job_id>', methods=['PUT'])
 @token_required
@@ -165,7 +471,19 @@ def update_job(current_user, job_id):
             update_fields['benefits'] = data['benefits']
 
         # Update the job in the collection
-        jobs_collection.update_one({"_id": ObjectId(job_id)}, {"$set": update_fields})
+        update_fields['updated_at'] = datetime.datetime.utcnow()
+        jobs_collection.update_one({"_id": ObjectId(job_id)}, {"$set": update_fields, "$inc": {"version": 1}})
+        invalidate_job(job_id)
+        bump_collection_version("jobs")
+        # Candidates' application lists show the job's title, company and location
+        bump_listing_versions(my_jobs=[current_user],
+                              my_applications=job_applications_collection.distinct("user_id", {"job_id": ObjectId(job_id)}))
+        job_search = get_job_search()
+        if job_search is not None:
+            job_search.add({**job, **update_fields})
+        if 'title' in update_fields:
+            # Messages store the job title they are displayed with
+            sync_message_job(job_id, update_fields['title'])
 
         return jsonify({"status": "success", "message": "Job updated successfully"}), 200
 
@@ -189,6 +507,15 @@ def delete_job(current_user, job_id):
 
         # Attempt to delete the job
         jobs_collection.delete_one({"_id": ObjectId(job_id)})
+        record_job_deletion(job_id)
+        invalidate_job(job_id)
+        bump_collection_version("jobs")
+        # Applications to a deleted job drop out of the candidates' lists
+        bump_listing_versions(my_jobs=[current_user],
+                              my_applications=job_applications_collection.distinct("user_id", {"job_id": ObjectId(job_id)}))
+        job_search = get_job_search()
+        if job_search is not None:
+            job_search.remove(job['_id'])
         return jsonify({"status": "success", "message": "Job deleted successfully"}), 200
 
     except Exception as e:
@@ -1,11 +1,43 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from bson.objectid import ObjectId
-from app.models import get_messages_collection, get_message_by_id, mark_message_as_read, get_messages_by_application_id, get_users_collection, get_jobs_collection
+from app.models import get_messages_collection, get_message_by_id, mark_message_as_read, get_messages_by_application_id, get_loader, BatchLoader, MESSAGE_DENORMALIZED_FIELDS, message_denormalized_fields, get_listing_version, count_documents, get_unread_count, mark_messages_as_read
 from app.decorators import token_required
+from app.utils import keyset_filter, keyset_page, keyset_sort, conditional, get_count_strategy, stream_list, iter_batches
+from app.admission import admission_class
+from app.events import hub, message_event, format_event
 import datetime
+import itertools
+import time
 
 messages_bp = Blueprint('messages', __name__)
 
+# Messages store the usernames, job title and company name they are displayed with.
+# Older messages that don't have them yet are enriched through the request loader.
+def is_denormalized(message):
+    return all(field in message for field in MESSAGE_DENORMALIZED_FIELDS)
+
+def queue_message_enrichment(loader, message):
+    if not is_denormalized(message):
+        loader.queue("users", message['sender_id'], message['receiver_id'])
+        loader.queue("jobs", message['job_id'])
+
+def message_display_fields(loader, message):
+    if is_denormalized(message):
+        fields = {field: message[field] for field in MESSAGE_DENORMALIZED_FIELDS}
+    else:
+        fields = message_denormalized_fields(
+            loader.get("users", message['sender_id']),
+            loader.get("users", message['receiver_id']),
+            loader.get("jobs", message['job_id'])
+        )
+    job_found = fields['job_title'] is not None
+    return {
+        'sender_username': fields['sender_username'] or 'Unknown',
+        'receiver_username': fields['receiver_username'] or 'Unknown',
+        'job_name': fields['job_title'] if job_found else 'Unknown Job',
+        'company_name': fields['company_name'] if job_found else 'Unknown Company'
+    }
+
 # Get all messages for a specific application
 @messages_bp.route('/application/<application_id>', methods=['GET'])
 @token_required
@@ -19,81 +51,116 @@ def get_messages_for_application(current_user, application_id):
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Adds sender, receiver and job info to the messages, numbering them from `counter`. Users and jobs still needed are read with one query each.
+def enrich_messages(messages, counter, loader):
+    for message in messages:
+        queue_message_enrichment(loader, message)
+
+    enriched_messages = []
+    for message in messages:
+        # Enrich the message with sender and receiver usernames and job details
+        enriched_messages.append({
+            'counter': counter,
+            'id': message['_id'],
+            'message': message['message'],
+            'status': message['status'],
+            'read_status': message['read_status'],
+            'timestamp': message['timestamp'],
+            **message_display_fields(loader, message)
+        })
+        counter += 1  # Increment the counter for each message
+    return enriched_messages
+
 # Get all messages for the current logged-in user (receiver)
 @messages_bp.route('/user/messages', methods=['GET'])
 @token_required
+@conditional(lambda current_user: get_listing_version("inbox", current_user))
 def get_messages_for_user(current_user):
     try:
         # Fetch page_size and current_page from query parameters, with defaults
         page_size = int(request.args.get('page_size', 10))  # Default to 10 messages per page
         current_page = int(request.args.get('current_page', 1))  # Default to the first page
+        after = request.args.get('after')  # Opaque cursor, switches to keyset pagination
 
         messages_collection = get_messages_collection()
-        users_collection = get_users_collection()
-        jobs_collection = get_jobs_collection()
 
         # Get total count of messages for the user
-        total_count = messages_collection.count_documents({"receiver_id": ObjectId(current_user)})
+        message_filter = {"receiver_id": ObjectId(current_user)}
+        try:
+            total_count = count_documents(messages_collection, message_filter, get_count_strategy(request.args))
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+        next_cursor = None
 
-        # Pagination logic - Skip the messages for previous pages and limit the results
-        if current_page > 0:
-            skip_count = (current_page - 1) * page_size
-            messages_cursor = messages_collection.find({"receiver_id": ObjectId(current_user)}).skip(skip_count).limit(page_size)
+        if after is not None:
+            # Keyset pagination - newest messages first, no skipping
+            try:
+                keyset_query, position = keyset_filter(message_filter, 'timestamp', after)
+            except ValueError as e:
+                return jsonify({"status": "error", "error": str(e)}), 400
+            messages_cursor = messages_collection.find(keyset_query).sort(keyset_sort('timestamp')).limit(page_size + 1)
+            messages, next_cursor = keyset_page(list(messages_cursor), 'timestamp', page_size, position)
+            counter = position + 1
         else:
-            # If current_page is 0, return the whole list
-            messages_cursor = messages_collection.find({"receiver_id": ObjectId(current_user)})
+            # Pagination logic - Skip the messages for previous pages and limit the results
+            if current_page > 0:
+                skip_count = (current_page - 1) * page_size
+                messages_cursor = messages_collection.find(message_filter).skip(skip_count).limit(page_size)
+            else:
+                # If current_page is 0, return the whole list
+                messages_cursor = messages_collection.find(message_filter)
+
+            counter = (current_page - 1) * page_size + 1  # Start the counter based on the page
+            if current_page == 0:
+                # The whole list is streamed, enriched one batch at a time
+                batches = iter_batches(messages_cursor, current_app.config['STREAM_BATCH_SIZE'])
+                first_batch = next(batches, None)
+                if first_batch is None:
+                    return jsonify({"status": "error", "error": "No messages found"}), 404
 
-        messages = list(messages_cursor)
+                def rows(counter):
+                    for batch in itertools.chain([first_batch], batches):
+                        # A loader per batch, so memory doesn't grow with the export
+                        yield from enrich_messages(batch, counter, BatchLoader())
+                        counter += len(batch)
+
+                response = {
+                    "status": "success",
+                    "total_count": total_count,
+                    "current_page": current_page,
+                    "page_size": page_size
+                }
+                return stream_list(response, "messages", rows(counter))
+
+            messages = list(messages_cursor)
 
         if not messages:
             return jsonify({"status": "error", "error": "No messages found"}), 404
 
-        # Convert ObjectId to string for JSON serialization and enrich with sender, receiver, and job info
-        enriched_messages = []
-        counter = (current_page - 1) * page_size + 1  # Start the counter based on the page
-
-        for message in messages:
-            message['_id'] = str(message['_id'])
-            message['job_id'] = str(message['job_id'])
-            message['application_id'] = str(message['application_id'])
-            message['sender_id'] = str(message['sender_id'])
-            message['receiver_id'] = str(message['receiver_id'])
-
-            # Fetch the sender's and receiver's user details
-            sender = users_collection.find_one({"_id": ObjectId(message['sender_id'])}, {"username": 1, "_id": 0})
-            receiver = users_collection.find_one({"_id": ObjectId(message['receiver_id'])}, {"username": 1, "_id": 0})
-
-            # Fetch job details
-            job = jobs_collection.find_one({"_id": ObjectId(message['job_id'])})
-
-            # Enrich the message with sender and receiver usernames and job details
-            enriched_message = {
-                'counter': counter,
-                'id': message['_id'],
-                'message': message['message'],
-                'status': message['status'],
-                'read_status': message['read_status'],
-                'timestamp': message['timestamp'],
-                'sender_username': sender['username'] if sender else 'Unknown',
-                'receiver_username': receiver['username'] if receiver else 'Unknown',
-                'job_name': job['title'] if job else 'Unknown Job',
-                'company_name': job['company_name'] if job else 'Unknown Company'
-            }
-
-            enriched_messages.append(enriched_message)
-            counter += 1  # Increment the counter for each message
-
-        return jsonify({
+        response = {
             "status": "success",
-            "messages": enriched_messages,
+            "messages": enrich_messages(messages, counter, get_loader()),
             "total_count": total_count,
             "current_page": current_page,
             "page_size": page_size
-        }), 200
+        }
+        if after is not None:
+            response["current_page"] = None
+            response["next_cursor"] = next_cursor
+        return jsonify(response), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Number of unread messages of the logged-in user, for the inbox badge
+@messages_bp.route('/user/unread-count', methods=['GET'])
+@token_required
+def get_unread_count_route(current_user):
+    unread_count = get_unread_count(current_user)
+    if unread_count is None:
+        return jsonify({"status": "error", "error": "User not found"}), 404
+    return jsonify({"status": "success", "unread_count": unread_count}), 200
+
 # Mark a message as read
 @messages_bp.route('/<message_id>/read', methods=['PATCH'])
 @token_required
@@ -115,8 +182,6 @@ def mark_message_as_read_route(current_user, message_id):
 def get_message_by_id_route(current_user, message_id):
     try:
         messages_collection = get_messages_collection()
-        users_collection = get_users_collection()
-        jobs_collection = get_jobs_collection()
 
         # Fetch the message using the message ID
         message = messages_collection.find_one({"_id": ObjectId(message_id)})
@@ -124,38 +189,124 @@ def get_message_by_id_route(current_user, message_id):
         if not message:
             return jsonify({"status": "error", "error": "Message not found"}), 404
 
-        # Convert ObjectId to string for JSON serialization
-        message['_id'] = str(message['_id'])
-        message['job_id'] = str(message['job_id'])
-        message['application_id'] = str(message['application_id'])
-        message['sender_id'] = str(message['sender_id'])
-        message['receiver_id'] = str(message['receiver_id'])
-
         # Ensure that the current user is the receiver of the message
-        if message['receiver_id'] != str(current_user):
+        if str(message['receiver_id']) != current_user:
             return jsonify({"status": "error", "error": "Unauthorized access"}), 403
 
-        # Fetch the sender's and receiver's user details
-        sender = users_collection.find_one({"_id": ObjectId(message['sender_id'])}, {"username": 1, "_id": 0})
-        receiver = users_collection.find_one({"_id": ObjectId(message['receiver_id'])}, {"username": 1, "_id": 0})
-
-        # Fetch job details
-        job = jobs_collection.find_one({"_id": ObjectId(message['job_id'])})
-
         # Enrich the message with sender, receiver, and job details
+        loader = get_loader()
+        queue_message_enrichment(loader, message)
         enriched_message = {
             'id': message['_id'],
             'message': message['message'],
             'status': message['status'],
             'read_status': message['read_status'],
             'timestamp': message['timestamp'],
-            'sender_username': sender['username'] if sender else 'Unknown',
-            'receiver_username': receiver['username'] if receiver else 'Unknown',
-            'job_name': job['title'] if job else 'Unknown Job',
-            'company_name': job['company_name'] if job else 'Unknown Company'
+            **message_display_fields(loader, message)
         }
 
         return jsonify({"status": "success", "message": enriched_message}), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
+
+# Most ids accepted by one bulk request
+MAX_BULK_ITEMS = 500
+
+# Mark several messages as read: {"message_ids": [...]}. Messages that aren't the
+# caller's are reported as not_found; the others are marked with one update.
+@messages_bp.route('/read', methods=['PATCH'])
+@token_required
+def mark_messages_as_read_route(current_user):
+    data = request.get_json(silent=True) or {}
+    message_ids = data.get('message_ids')
+
+    if not isinstance(message_ids, list) or not all(isinstance(message_id, str) for message_id in message_ids):
+        return jsonify({"status": "error", "error": "message_ids must be a list of ids"}), 400
+    if len(message_ids) > MAX_BULK_ITEMS:
+        return jsonify({"status": "error", "error": f"At most {MAX_BULK_ITEMS} messages per request"}), 400
+
+    try:
+        results = mark_messages_as_read(current_user, message_ids)
+        return jsonify({
+            "status": "success",
+            "marked": sum(1 for result in results.values() if result == "read"),
+            "results": [{"message_id": message_id, "result": results[message_id]} for message_id in message_ids]
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Messages received after `last_event_id`, oldest first, as events
+def missed_events(current_user, last_event_id, limit):
+    messages_collection = get_messages_collection()
+    messages = list(messages_collection.find(
+        {"receiver_id": ObjectId(current_user), "_id": {"$gt": ObjectId(last_event_id)}}
+    ).sort("_id", 1).limit(limit))
+    loader = get_loader()
+    for message in messages:
+        queue_message_enrichment(loader, message)
+    events = []
+    for message in messages:
+        if not is_denormalized(message):
+            message = {**message, **message_denormalized_fields(
+                loader.get("users", message['sender_id']),
+                loader.get("users", message['receiver_id']),
+                loader.get("jobs", message['job_id'])
+            )}
+        events.append(message_event(message))
+    return events
+
+# Server-sent events for the current user: a "message" event for every message
+# received (application status changes included), instead of polling the inbox.
+# Reconnecting with Last-Event-ID (or ?last_event_id=) first replays what was missed.
+# Streams end after EVENTS_MAX_SECONDS, or when the client falls too far behind,
+# and the client reconnects. Open streams are limited by the "events" admission
+# class; past it new ones get a 503 with Retry-After.
+@messages_bp.route('/user/events', methods=['GET'])
+@admission_class("events")
+@token_required
+def stream_events(current_user):
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id and not ObjectId.is_valid(last_event_id):
+        return jsonify({"status": "error", "error": "Invalid Last-Event-ID"}), 400
+
+    config = current_app.config
+    heartbeat = config['EVENTS_HEARTBEAT_SECONDS']
+    replay_limit = config['EVENTS_REPLAY_LIMIT']
+
+    # Subscribed before reading the missed messages so none fall in between
+    subscription = hub.subscribe(current_user)
+    try:
+        replay = missed_events(current_user, last_event_id, replay_limit) if last_event_id else []
+    except Exception:
+        hub.unsubscribe(subscription)
+        raise
+    deadline = time.monotonic() + config['EVENTS_MAX_SECONDS']
+
+    def generate():
+        try:
+            yield "retry: %d\n\n" % config['EVENTS_RETRY_MS']
+            for event in replay:
+                yield format_event(event)
+            if len(replay) == replay_limit:
+                return  # More to catch up on after reconnecting
+            replayed = {event['id'] for event in replay}
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = subscription.get(0 if subscription.overflowed else min(heartbeat, remaining))
+                if event is None:
+                    if subscription.overflowed:
+                        return
+                    yield ": keep-alive\n\n"
+                elif event['id'] not in replayed:
+                    yield format_event(event)
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = current_app.response_class(generate(), mimetype='text/event-stream')
+    response.call_on_close(lambda: hub.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
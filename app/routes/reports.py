@@ -1,15 +1,11 @@
-from flask import Blueprint, request, jsonify
-from app.models import get_users_collection, get_jobs_collection, get_job_applications_collection
+from flask import Blueprint, request, jsonify, current_app
+from app.models import get_users_count_by_date_range, get_jobs_count_by_date_range, get_application_funnel, FUNNEL_GROUPS
+from app.rollups import histogram, histogram_bucket_count, HISTOGRAM_BUCKETS
 from app.decorators import token_required_admin 
 import datetime
 
 reports_bp = Blueprint('reports', __name__)
 
-# Getting the collections
-users_collection = get_users_collection()
-jobs_collection = get_jobs_collection()
-applicants_collection = get_job_applications_collection()
-
 # Helper function to parse dates and times
 def parse_datetime(datetime_str):
     try:
@@ -35,10 +31,8 @@ def report_users(current_admin):
     if not start_date_parsed or not end_date_parsed:
         return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DDTHH:MM:SS."}), 400
 
-    # Count users created in the given date range
-    user_count = users_collection.count_documents({
-        "createdAt": {"$gte": start_date_parsed, "$lt": end_date_parsed}
-    })
+    # Count users created in the given date range (daily rollups + live count for today)
+    user_count = get_users_count_by_date_range(start_date_parsed, end_date_parsed)
 
     return jsonify({
         "status": "success",
@@ -66,10 +60,8 @@ def report_jobs(current_admin):
     if not start_date_parsed or not end_date_parsed:
         return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DDTHH:MM:SS."}), 400
 
-    # Count jobs posted in the given date range
-    job_count = jobs_collection.count_documents({
-        "date_posted": {"$gte": start_date_parsed, "$lt": end_date_parsed}
-    })
+    # Count jobs posted in the given date range (daily rollups + live count for today)
+    job_count = get_jobs_count_by_date_range(start_date_parsed, end_date_parsed)
 
     return jsonify({
         "status": "success",
@@ -77,3 +69,86 @@ def report_jobs(current_admin):
         "end_date": end_date,
         "job_count": job_count
     }), 200
+
+# `metric` values of the histogram and the rollup metric they count
+HISTOGRAM_METRICS = {
+    "users": "signups",
+    "jobs": "jobs_posted",
+    "applications": "applications",
+    "messages": "messages"
+}
+MAX_HISTOGRAM_BUCKETS = 10000
+
+# Counts per hour/day/week/month between two dates, for the admin charts.
+# One request and one query for the whole series; empty buckets are returned as 0.
+@reports_bp.route('/report/histogram', methods=['GET'])
+@token_required_admin
+def report_histogram(current_admin):
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    bucket = request.args.get('bucket', 'day')
+    metric = request.args.get('metric', 'users')
+
+    if not start_date or not end_date:
+        return jsonify({"status": "error", "message": "Start date and end date are required"}), 400
+
+    start_date_parsed = parse_datetime(start_date)
+    end_date_parsed = parse_datetime(end_date)
+
+    if not start_date_parsed or not end_date_parsed:
+        return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DDTHH:MM:SS."}), 400
+    if start_date_parsed >= end_date_parsed:
+        return jsonify({"status": "error", "message": "Start date must be before end date"}), 400
+    if metric not in HISTOGRAM_METRICS:
+        return jsonify({"status": "error", "message": "metric must be one of: " + ", ".join(HISTOGRAM_METRICS)}), 400
+    if bucket not in HISTOGRAM_BUCKETS:
+        return jsonify({"status": "error", "message": "bucket must be one of: " + ", ".join(HISTOGRAM_BUCKETS)}), 400
+    if histogram_bucket_count(start_date_parsed, end_date_parsed, bucket) > MAX_HISTOGRAM_BUCKETS:
+        return jsonify({"status": "error", "message": "Too many buckets, use a shorter range or a larger bucket"}), 400
+
+    series = histogram(HISTOGRAM_METRICS[metric], start_date_parsed, end_date_parsed, bucket)
+
+    response = jsonify({
+        "status": "success",
+        "start_date": start_date,
+        "end_date": end_date,
+        "metric": metric,
+        "bucket": bucket,
+        "total": sum(count for _, count in series),
+        "series": [{"start": bucket_start, "count": count} for bucket_start, count in series]
+    })
+    if end_date_parsed <= datetime.datetime.utcnow():
+        # A range that is over always gets the same answer
+        response.headers['Cache-Control'] = f"private, max-age={current_app.config['HISTOGRAM_CACHE_SECONDS']}"
+    return response, 200
+
+# Application funnel: applications made between two dates by status, with the
+# average time to the first status change; ?group_by=sector|company_name splits it per job field
+@reports_bp.route('/report/applications', methods=['GET'])
+@token_required_admin
+def report_applications(current_admin):
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    group_by = request.args.get('group_by') or None
+
+    if not start_date or not end_date:
+        return jsonify({"status": "error", "message": "Start date and end date are required"}), 400
+
+    start_date_parsed = parse_datetime(start_date)
+    end_date_parsed = parse_datetime(end_date)
+
+    if not start_date_parsed or not end_date_parsed:
+        return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DDTHH:MM:SS."}), 400
+    if group_by is not None and group_by not in FUNNEL_GROUPS:
+        return jsonify({"status": "error", "message": "group_by must be one of: " + ", ".join(FUNNEL_GROUPS)}), 400
+
+    funnel = get_application_funnel(start_date_parsed, end_date_parsed, group_by)
+
+    return jsonify({
+        "status": "success",
+        "start_date": start_date,
+        "end_date": end_date,
+        "group_by": group_by,
+        "application_count": sum(group["total"] for group in funnel),
+        "funnel": funnel
+    }), 200
@@ -1,11 +1,12 @@
 from flask import Blueprint, request, jsonify
 from bson.objectid import ObjectId
-from app.models import get_users_collection, get_resumes_collection
+from app.models import get_users_collection, get_resumes_collection, get_resume_by_user_id as find_resume_by_user_id, invalidate_resume, CollectionProxy
 from app.decorators import token_required
+from app.utils import requested_fields, fields_projection, select_fields
 
 resume_bp = Blueprint('resume', __name__)
-users_collection = get_users_collection()
-resumes_collection = get_resumes_collection()
+users_collection = CollectionProxy(get_users_collection)
+resumes_collection = CollectionProxy(get_resumes_collection)
 
 # Schema for the resume collection
 def create_resume_schema():
@@ -22,6 +23,12 @@ def create_resume_schema():
         "references": []
     }
 
+# Fields that can be picked with ?fields=, and named sets of them
+RESUME_FIELDS = tuple(create_resume_schema())
+RESUME_FIELD_PRESETS = {
+    "summary": ('user_id', 'about', 'skills', 'languages')
+}
+
 # Add or update resume section
 @resume_bp.route('/resume', methods=['POST'])
 @token_required
@@ -48,6 +55,7 @@ def add_resume_section(current_user):
             {"$set": resume},
             upsert=True
         )
+        invalidate_resume(user_id)
         return jsonify({"status": "success", "message": "Resume updated successfully"}), 200
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
@@ -56,13 +64,16 @@ def add_resume_section(current_user):
 @resume_bp.route('/resume', methods=['GET'])
 @token_required
 def get_resume(current_user):
-    user_id = ObjectId(current_user)
     try:
-        resume = resumes_collection.find_one({"user_id": user_id}, {"_id": 0})
+        fields = requested_fields(request.args, RESUME_FIELDS, RESUME_FIELD_PRESETS)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    try:
+        # Only the requested fields are read from Mongo when the resume isn't cached
+        resume = find_resume_by_user_id(current_user, fields)
         if resume:
-            # Convert ObjectId to string
-            resume["user_id"] = str(resume["user_id"])
-            return jsonify({"status": "success", "resume": resume}), 200
+            resume.pop("_id")
+            return jsonify({"status": "success", "resume": select_fields(resume, fields)}), 200
         else:
             return jsonify({"status": "error", "message": "Resume not found"}), 404
     except Exception as e:
@@ -72,16 +83,18 @@ def get_resume(current_user):
 @resume_bp.route('/resume/<resume_id>', methods=['GET'])
 @token_required
 def get_resume_by_id(current_user, resume_id):
+    try:
+        fields = requested_fields(request.args, RESUME_FIELDS, RESUME_FIELD_PRESETS)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     try:
         # Validate the resume_id
         resume_id = ObjectId(resume_id)
         
         # Retrieve the resume by ID
-        resume = resumes_collection.find_one({"_id": resume_id})
+        resume = resumes_collection.find_one({"_id": resume_id}, fields_projection(fields))
         
         if resume:
-            # Convert ObjectId to string for JSON response
-            resume["user_id"] = str(resume["user_id"])
             return jsonify({"status": "success", "resume": resume}), 200
         else:
             return jsonify({"status": "error", "message": "Resume not found"}), 404
@@ -96,13 +109,16 @@ def get_resume_by_user_id(current_user, user_id):
         # Check if the user_id is valid
         if not ObjectId.is_valid(user_id):
             return jsonify({"status": "error", "message": "Invalid user ID"}), 400
+        try:
+            fields = requested_fields(request.args, RESUME_FIELDS, RESUME_FIELD_PRESETS)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
         
         # Retrieve the resume by user_id
-        resume = resumes_collection.find_one({"user_id": ObjectId(user_id)}, {"_id": 0})
+        resume = find_resume_by_user_id(user_id, fields)
         if resume:
-            # Convert ObjectId to string
-            resume["user_id"] = str(resume["user_id"])
-            return jsonify({"status": "success", "resume": resume}), 200
+            resume.pop("_id")
+            return jsonify({"status": "success", "resume": select_fields(resume, fields)}), 200
         else:
             return jsonify({"status": "error", "message": "Resume not found"}), 404
     except Exception as e:
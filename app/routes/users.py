@@ -1,14 +1,21 @@
 from flask import Blueprint, request, jsonify, current_app
-from app import bcrypt
-from app.models import get_users_collection
+from app.passwords import passwords
+from app.models import get_users_collection, sync_message_username, get_user_profile_by_id, invalidate_user_profile, get_job_applications_collection, bump_listing_versions, CollectionProxy
 from app.decorators import token_required
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 import jwt
 import datetime
-from app.utils import validate_token
+from app.utils import validate_token, bearer_token, requested_fields, select_fields
 
 users_bp = Blueprint('users', __name__)
-users_collection = get_users_collection()
+users_collection = CollectionProxy(get_users_collection)
+
+# Profile fields that can be picked with ?fields=, and named sets of them
+USER_FIELDS = ('first_name', 'last_name', 'username', 'email', 'birth_date')
+USER_FIELD_PRESETS = {
+    "summary": ('username', 'first_name', 'last_name')
+}
 
 @users_bp.route('/signup', methods=['POST'])
 def signup():
@@ -21,20 +28,20 @@ def signup():
             "error": "Missing fields"
         }), 400
 
-    if users_collection.find_one({"email": data['email']}):
+    if users_collection.find_one({"email": data['email']}, {"_id": 1}):
         return jsonify({
             "status": "error",
             "error": "Email already exists"
         }), 400
 
     # Check if username already exists
-    if users_collection.find_one({"username": data['username']}):
+    if users_collection.find_one({"username": data['username']}, {"_id": 1}):
         return jsonify({
             "status": "error",
             "error": "Username already exists"
         }), 400
 
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    hashed_password = passwords.hash(data['password'])
     
     user = {
         "first_name": data['first_name'],
@@ -52,6 +59,12 @@ def signup():
         "status": "success",
         "message": "User created successfully"
         }), 201
+    except DuplicateKeyError:
+        # Another signup with the same email or username won the race
+        return jsonify({
+            "status": "error",
+            "error": "Username or email already exists"
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -61,9 +74,10 @@ def signup():
 @users_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
-    user = users_collection.find_one({"username": data['username']})
+    user = users_collection.find_one({"username": data['username']}, {"password": 1})
     
-    if user and bcrypt.check_password_hash(user['password'], data['password']):
+    if user and passwords.check(user['password'], data['password']):
+        passwords.rehash_if_outdated(users_collection, user, data['password'])
         token = jwt.encode({
             'user_id': str(user['_id']),
             'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
@@ -85,17 +99,22 @@ def login():
 @token_required
 def get_profile(current_user):
     try:
-        user = users_collection.find_one({"_id": ObjectId(current_user)})
+        fields = requested_fields(request.args, USER_FIELDS, USER_FIELD_PRESETS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # Only the requested fields are read from Mongo when the profile isn't cached
+        user = get_user_profile_by_id(current_user, fields)
         if user:
             user_data = {
                 "user_id": str(user["_id"]),  # Include user_id for updates
-                "first_name": user["first_name"],
-                "last_name": user["last_name"],
-                "username": user["username"],
-                "email": user["email"],
-                "birth_date": user["birth_date"]
+                "first_name": user.get("first_name"),
+                "last_name": user.get("last_name"),
+                "username": user.get("username"),
+                "email": user.get("email"),
+                "birth_date": user.get("birth_date")
             }
-            return jsonify({"user": user_data}), 200
+            return jsonify({"user": select_fields(user_data, fields, "user_id")}), 200
         else:
             return jsonify({"error": "User not found"}), 404
     except Exception as e:
@@ -113,15 +132,15 @@ def update_profile(current_user):
     if 'last_name' in data:
         update_fields['last_name'] = data['last_name']
     if 'username' in data:
-        if users_collection.find_one({"username": data['username'], "_id": {"$ne": ObjectId(current_user)}}):
+        if users_collection.find_one({"username": data['username'], "_id": {"$ne": ObjectId(current_user)}}, {"_id": 1}):
             return jsonify({"status": "error", "message": "Username already taken"}), 400
         update_fields['username'] = data['username']
     if 'email' in data:
-        if users_collection.find_one({"email": data['email'], "_id": {"$ne": ObjectId(current_user)}}):
+        if users_collection.find_one({"email": data['email'], "_id": {"$ne": ObjectId(current_user)}}, {"_id": 1}):
             return jsonify({"status": "error", "message": "Email already exists"}), 400
         update_fields['email'] = data['email']
     if 'password' in data:
-        update_fields['password'] = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+        update_fields['password'] = passwords.hash(data['password'])
     if 'birth_date' in data:
         update_fields['birth_date'] = data['birth_date']
 
@@ -130,15 +149,22 @@ def update_profile(current_user):
 
     try:
         users_collection.update_one({"_id": ObjectId(current_user)}, {"$set": update_fields})
+        invalidate_user_profile(current_user)
+        if 'username' in update_fields:
+            # Messages store the usernames they are displayed with, application lists show them
+            sync_message_username(current_user, update_fields['username'])
+            bump_listing_versions(job_applications=get_job_applications_collection().distinct(
+                "job_id", {"user_id": ObjectId(current_user)}))
         return jsonify({"status": "success", "message": "Profile updated successfully"}), 200
+    except DuplicateKeyError:
+        return jsonify({"status": "error", "message": "Username or email already taken"}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @users_bp.route('/check_login', methods=['GET'])
 def check_login_status():
-    auth_header = request.headers.get('Authorization')
-    if auth_header:
-        token = auth_header.split(" ")[1]  # Assuming the header is in the format "Bearer <token>"
+    token = bearer_token()
+    if token:
         is_valid, user_info = validate_token(token)
 
         if is_valid:
@@ -162,17 +188,21 @@ def check_login_status():
 @token_required
 def get_user_by_id(current_user, user_id):
     try:
-        user = users_collection.find_one({"_id": ObjectId(user_id)}, {"password": 0})  # Exclude the password field
+        fields = requested_fields(request.args, USER_FIELDS, USER_FIELD_PRESETS)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        user = get_user_profile_by_id(user_id, fields)  # Cached, without the password field
         if user:
             user_data = {
                 "user_id": str(user["_id"]),  # Convert ObjectId to string
-                "first_name": user["first_name"],
-                "last_name": user["last_name"],
-                "username": user["username"],
-                "email": user["email"],
-                "birth_date": user["birth_date"]
+                "first_name": user.get("first_name"),
+                "last_name": user.get("last_name"),
+                "username": user.get("username"),
+                "email": user.get("email"),
+                "birth_date": user.get("birth_date")
             }
-            return jsonify({"status": "success", "user": user_data}), 200
+            return jsonify({"status": "success", "user": select_fields(user_data, fields, "user_id")}), 200
         else:
             return jsonify({"status": "error", "message": "User not found"}), 404
     except Exception as e:
@@ -0,0 +1,225 @@
+from flask import current_app
+from pymongo import ASCENDING, DESCENDING
+from app import mongo
+import datetime
+import heapq
+import logging
+import math
+import re
+import threading
+
+# In-process job search engine
+# An inverted index over the jobs collection, scored with BM25. It is optional
+# (JOB_SEARCH_ENGINE = 'memory'); when enabled, keyword searches on the job listing
+# are answered from memory and Mongo is only used to load the jobs on the page.
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Indexed fields and how many times a term found in them counts
+FIELD_WEIGHTS = {
+    "title": 3,
+    "requirements": 1,
+    "description": 1,
+    "sector": 1
+}
+
+# Fields that searches can be restricted to with an exact match
+FILTER_FIELDS = ('sector', 'location', 'job_type', 'company_name')
+
+def tokenize(text):
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(item) for item in text)
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+class JobSearchIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._reset()
+        self.ready = False
+        self.synced_at = None
+        self.deletions_synced_at = None
+
+    def _reset(self):
+        self._postings = {}       # term -> {job_id: term frequency}
+        self._terms = {}          # job_id -> terms of the job, to remove it again
+        self._lengths = {}        # job_id -> document length
+        self._filters = {}        # job_id -> {filter field: value}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, job):
+        # Adds a job, replacing it if it's already indexed
+        frequencies = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(job.get(field)):
+                frequencies[term] = frequencies.get(term, 0) + weight
+
+        with self._lock:
+            self._remove(job["_id"])
+            for term, frequency in frequencies.items():
+                self._postings.setdefault(term, {})[job["_id"]] = frequency
+            length = sum(frequencies.values())
+            self._terms[job["_id"]] = list(frequencies)
+            self._lengths[job["_id"]] = length
+            self._total_length += length
+            self._filters[job["_id"]] = {field: job.get(field) for field in FILTER_FIELDS}
+
+    def remove(self, job_id):
+        with self._lock:
+            self._remove(job_id)
+
+    def _remove(self, job_id):
+        if job_id not in self._lengths:
+            return
+        for term in self._terms.pop(job_id):
+            postings = self._postings[term]
+            del postings[job_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(job_id)
+        del self._filters[job_id]
+
+    def search(self, query, filters=None, offset=0, limit=10):
+        # Returns (number of matches, ids of the matches in [offset, offset + limit))
+        # ranked by BM25; `limit=None` returns every match.
+        terms = set(tokenize(query))
+        filters = filters or {}
+        with self._lock:
+            count = len(self._lengths)
+            if not count or not terms:
+                return 0, []
+            average_length = self._total_length / count or 1
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for job_id, frequency in postings.items():
+                    if filters and any(self._filters[job_id].get(field) != value for field, value in filters.items()):
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[job_id] / average_length)
+                    scores[job_id] = scores.get(job_id, 0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        # Only the top offset + limit scores are ordered, not every match
+        if limit is None:
+            ranked = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        else:
+            ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return len(scores), [job_id for job_id, _ in ranked[offset:]]
+
+    def load(self, jobs_collection, tombstones_collection, batch_size=1000):
+        # Builds a new index from the whole collection, reading it in _id batches,
+        # and swaps it in at the end so searches keep working during the load.
+        # The sync marks are taken first: whatever changes during the load is newer.
+        fresh = JobSearchIndex(self.k1, self.b)
+        synced_at = latest(jobs_collection, "updated_at")
+        deletions_synced_at = latest(tombstones_collection, "deleted_at")
+        last_id = None
+        while True:
+            query = {} if last_id is None else {"_id": {"$gt": last_id}}
+            batch = list(jobs_collection.find(query, self._projection()).sort("_id", ASCENDING).limit(batch_size))
+            if not batch:
+                break
+            for job in batch:
+                fresh.add(job)
+            last_id = batch[-1]["_id"]
+
+        with self._lock:
+            self._postings = fresh._postings
+            self._terms = fresh._terms
+            self._lengths = fresh._lengths
+            self._filters = fresh._filters
+            self._total_length = fresh._total_length
+            self.synced_at = synced_at
+            self.deletions_synced_at = deletions_synced_at
+            self.ready = True
+
+    def resync(self, jobs_collection, tombstones_collection, batch_size=1000, overlap=datetime.timedelta(seconds=5)):
+        # Catches up with writes made by other processes: re-adds jobs updated since
+        # the last sync and drops jobs deleted since then (job_tombstones).
+        # The marks are the newest updated_at/deleted_at seen, i.e. times written by
+        # the database clients, not this process's clock; `overlap` covers writers
+        # whose clocks are slightly behind.
+        if not self.ready:
+            return self.load(jobs_collection, tombstones_collection, batch_size)
+
+        deleted = tombstones_collection.find(since("deleted_at", self.deletions_synced_at, overlap))
+        for tombstone in deleted.batch_size(batch_size):
+            self.remove(tombstone["_id"])
+            self.deletions_synced_at = max_time(self.deletions_synced_at, tombstone["deleted_at"])
+
+        changed = jobs_collection.find(since("updated_at", self.synced_at, overlap), self._projection())
+        for job in changed.batch_size(batch_size):
+            self.add(job)
+            self.synced_at = max_time(self.synced_at, job["updated_at"])
+
+    @staticmethod
+    def _projection():
+        return {field: 1 for field in list(FIELD_WEIGHTS) + list(FILTER_FIELDS) + ["updated_at"]}
+
+def latest(collection, field):
+    # The newest value of a date field, or None
+    document = collection.find_one({field: {"$type": "date"}}, {field: 1}, sort=[(field, DESCENDING)])
+    return document[field] if document else None
+
+def since(field, mark, overlap):
+    if mark is None:
+        return {field: {"$type": "date"}}
+    return {field: {"$gte": mark - overlap}}
+
+def max_time(mark, value):
+    if not isinstance(value, datetime.datetime):
+        return mark
+    return value if mark is None or value > mark else mark
+
+def init_job_search(app):
+    if app.config['JOB_SEARCH_ENGINE'] != 'memory':
+        return None
+
+    index = JobSearchIndex()
+    app.extensions['job_search'] = index
+    sync_job_search(app)
+    start_job_search_resync(app)
+    return index
+
+def sync_job_search(app):
+    try:
+        app.extensions['job_search'].resync(mongo.db.jobs, mongo.db.job_tombstones, app.config['JOB_SEARCH_BATCH_SIZE'])
+    except Exception as e:
+        logger.error("Job search index sync failed: %s", e)
+
+# The index is kept up to date by a thread of its own. Threads don't survive a
+# fork, so a preloaded app stops it before forking and every worker starts one.
+def start_job_search_resync(app):
+    interval = app.config['JOB_SEARCH_RESYNC_SECONDS']
+    if 'job_search' not in app.extensions or not interval:
+        return
+    stop = threading.Event()
+    app.extensions['job_search_stop'] = stop
+
+    def resync_forever():
+        while not stop.wait(interval):
+            sync_job_search(app)
+
+    threading.Thread(target=resync_forever, name="job-search-resync", daemon=True).start()
+
+def stop_job_search_resync(app):
+    stop = app.extensions.pop('job_search_stop', None)
+    if stop is not None:
+        stop.set()
+
+def get_job_search():
+    # The in-memory index, or None when it's disabled or not loaded yet
+    index = current_app.extensions.get('job_search')
+    if index is None or not index.ready:
+        return None
+    return index
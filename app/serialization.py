@@ -0,0 +1,24 @@
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+import datetime
+
+# JSON encoding
+# Documents can be returned as they come out of Mongo: ObjectIds are encoded as
+# their hex string and dates as HTTP dates (RFC 1123), as Flask always sent them.
+# The few fields the API has always sent in ISO 8601 (application dates, a
+# company's created_at) are formatted by their routes.
+
+class JSONProvider(DefaultJSONProvider):
+    sort_keys = False  # Keep the field order of the documents
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return http_date(o)
+        if isinstance(o, Decimal128):
+            return str(o)
+        return DefaultJSONProvider.default(o)
@@ -1,12 +1,210 @@
 import jwt
-from flask import current_app
+import json
+import base64
+import hashlib
+import datetime
+import time
+from functools import wraps
+from flask import current_app, request, Response, stream_with_context
+from bson.objectid import ObjectId
+from pymongo import DESCENDING
+from app.models import COUNT_STRATEGIES
+from app.cache import named_cache
+
+# Verified tokens
+# The same token comes with every request of a page load, so the claims of tokens
+# that passed verification are kept for TOKEN_CACHE_SECONDS, but never past the
+# token's own expiry. Only tokens that verified are cached, keyed by their digest.
+
+TOKEN_CLAIMS = ('user_id', 'admin_id', 'role')
+
+token_cache = named_cache("tokens", maxsize=4096, ttl=300)
+
+def bearer_token():
+    # The token of the Authorization header, with or without the "Bearer " prefix
+    header = request.headers.get('Authorization')
+    if not header:
+        return None
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):]
+    return header
+
+def decode_token(token):
+    # The TOKEN_CLAIMS of a valid token; raises jwt.InvalidTokenError otherwise
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    claims = token_cache.get(key)
+    if claims is None:
+        decoded = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+        claims = {name: decoded[name] for name in TOKEN_CLAIMS if name in decoded}
+        ttl = token_cache.ttl
+        if 'exp' in decoded:
+            ttl = min(ttl, decoded['exp'] - time.time())
+        if ttl > 0:
+            token_cache.set(key, claims, ttl=ttl)
+    return claims
 
 def validate_token(token):
     try:
-        decoded = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        user_id = decoded.get('user_id')
-        return True, user_id
+        return True, decode_token(token).get('user_id')
     except jwt.ExpiredSignatureError:
         return False, "Token has expired"
     except jwt.InvalidTokenError:
         return False, "Invalid token"
+
+# Keyset pagination
+# A cursor remembers the sort value and _id of the last row of a page, plus the
+# number of rows already returned so the "counter" field keeps counting.
+# Lists are walked newest first, i.e. sorted by (sort_field, _id) descending.
+
+def keyset_sort(sort_field):
+    return [(sort_field, DESCENDING), ("_id", DESCENDING)]
+
+def encode_cursor(sort_value, last_id, position):
+    if isinstance(sort_value, datetime.datetime):
+        sort_value = {"$date": sort_value.isoformat()}
+    payload = json.dumps({"v": sort_value, "id": str(last_id), "n": position}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        sort_value = payload["v"]
+        if isinstance(sort_value, dict):
+            sort_value = datetime.datetime.fromisoformat(sort_value["$date"])
+        return sort_value, ObjectId(payload["id"]), int(payload["n"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def keyset_filter(query, sort_field, after):
+    # Returns the query restricted to rows after the cursor and the cursor position
+    if not after:
+        return query, 0
+    sort_value, last_id, position = decode_cursor(after)
+    after_cursor = {"$or": [
+        {sort_field: {"$lt": sort_value}},
+        {sort_field: sort_value, "_id": {"$lt": last_id}}
+    ]}
+    return ({"$and": [query, after_cursor]} if query else after_cursor), position
+
+def keyset_page(rows, sort_field, page_size, position):
+    # `rows` must be fetched with limit(page_size + 1) so we know if there is a next page
+    page = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = page[-1]
+        next_cursor = encode_cursor(last[sort_field], last["_id"], position + len(page))
+    return page, next_cursor
+
+# Conditional GET
+# Routes declare what their response depends on (collection or document versions)
+# and get a weak ETag for it. A matching If-None-Match is answered with a 304
+# without running the route at all.
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def conditional(versions, public=False):
+    # `versions` is called with the route's arguments and returns the parts the
+    # response depends on, or None to skip the ETag (e.g. when nothing was found)
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            parts = versions(*args, **kwargs)
+            if parts is None:
+                return f(*args, **kwargs)
+
+            etag = make_etag(request.full_path, args, *parts)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if public:
+                response.headers['Cache-Control'] = f"public, max-age={current_app.config['PUBLIC_CACHE_MAX_AGE']}"
+            else:
+                response.headers['Cache-Control'] = "private, no-cache"
+            return response
+
+        return decorated_function
+    return decorator
+
+def get_count_strategy(args):
+    # `count` query parameter of the list endpoints, see app.models.count_documents
+    strategy = args.get('count') or 'approx'
+    if strategy not in COUNT_STRATEGIES:
+        raise ValueError("count must be one of: " + ", ".join(COUNT_STRATEGIES))
+    return strategy
+
+# Sparse fieldsets
+# `fields` picks which fields of each document a response includes, by name or by
+# preset (e.g. fields=summary). Names are checked against an allow-list per
+# resource; where the documents come from Mongo they become a projection, so
+# fewer bytes are read as well as sent. Documents found in the entity cache are
+# trimmed instead (see app.models.read_through).
+
+def requested_fields(args, allowed, presets=None):
+    # Requested field names in order, or None when whole documents are wanted
+    presets = presets or {}
+    fields = []
+    for name in (args.get('fields') or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name in presets:
+            names = presets[name]
+        elif name in allowed:
+            names = (name,)
+        else:
+            raise ValueError("Unknown field '%s', fields can be: %s" % (name, ", ".join(list(presets) + list(allowed))))
+        fields.extend(field for field in names if field not in fields)
+    return fields or None
+
+def fields_projection(fields, *always):
+    # `always` lists fields the route itself needs, e.g. a sort key
+    if fields is None:
+        return None
+    return {field: 1 for field in list(fields) + list(always)}
+
+def select_fields(document, fields, *always):
+    if fields is None:
+        return document
+    return {key: value for key, value in document.items() if key in fields or key in always}
+
+# Streaming
+# The `current_page=0` ("everything") mode of the list endpoints streams its rows
+# instead of building one big list, so memory stays flat and the first bytes are
+# sent right away.
+
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def json_list_chunks(envelope, list_key, rows):
+    # Everything up to the opening bracket of the list, e.g. '{"total_count":3,"jobs":['
+    head = current_app.json.dumps({**envelope, list_key: []}, sort_keys=False)
+    yield head[:head.rindex('[') + 1]
+    separator = ""
+    for row in rows:
+        yield separator + current_app.json.dumps(row)
+        separator = ","
+    yield "]}"
+
+def stream_list(envelope, list_key, rows):
+    # Streams `envelope` with `rows` (any iterable of dicts) as its `list_key` array,
+    # or the rows alone as NDJSON when the request has ?format=ndjson
+    if request.args.get('format') == 'ndjson':
+        def generate_ndjson():
+            for row in rows:
+                yield current_app.json.dumps(row) + "\n"
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+    return Response(stream_with_context(json_list_chunks(envelope, list_key, rows)), mimetype='application/json')
@@ -0,0 +1,87 @@
+"""Encoding a 1,000-job page: the old per-document str() loop vs the JSON provider.
+
+Jobs are BSON-encoded once up front and decoded on every run, the way a cursor
+hands them over, so the numbers include building the Python documents.
+
+    python benchmarks/json_encoding.py [--jobs 1000] [--repeat 20]
+"""
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+import bson
+from bson.objectid import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app.serialization import JSONProvider  # noqa: E402
+
+def make_jobs(count):
+    now = datetime.datetime.utcnow()
+    return [{
+        "_id": ObjectId(),
+        "title": "Backend developer %d" % i,
+        "date_posted": now - datetime.timedelta(minutes=i),
+        "updated_at": now,
+        "sector": "IT",
+        "salary": 50000 + i,
+        "location": "Berlin",
+        "job_type": "full-time",
+        "requirements": "Python, MongoDB, Flask and a few years of experience " * 3,
+        "description": "We are looking for a developer to join our team. " * 10,
+        "benefits": "Remote work, training budget",
+        "posted_by": {"user_id": ObjectId(), "company_id": ObjectId()},
+        "company_name": "Company %d" % (i % 50)
+    } for i in range(count)]
+
+def envelope(count):
+    return {"total_count": count, "page_size": count, "current_page": 1}
+
+def str_loop(app, page):
+    # What the routes did before: convert ids by hand, dates left to jsonify
+    with app.app_context():
+        jobs = []
+        for counter, raw in enumerate(page, start=1):
+            job = bson.decode(raw)
+            job['_id'] = str(job['_id'])
+            job['posted_by']['user_id'] = str(job['posted_by']['user_id'])
+            job['posted_by']['company_id'] = str(job['posted_by']['company_id'])
+            job['counter'] = counter
+            jobs.append(job)
+        return app.json.dumps({**envelope(len(page)), "jobs": jobs})
+
+def provider(app, page):
+    with app.app_context():
+        jobs = []
+        for counter, raw in enumerate(page, start=1):
+            job = bson.decode(raw)
+            job['counter'] = counter
+            jobs.append(job)
+        return app.json.dumps({**envelope(len(page)), "jobs": jobs})
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    page = [bson.encode(job) for job in make_jobs(args.jobs)]
+
+    legacy_app = Flask("legacy")
+    legacy_app.json = DefaultJSONProvider(legacy_app)
+    provider_app = Flask("provider")
+    provider_app.json = JSONProvider(provider_app)
+
+    runs = [("str() loop + default provider", str_loop, legacy_app), ("JSONProvider", provider, provider_app)]
+
+    print("%d jobs per page, best of %d runs" % (args.jobs, args.repeat))
+    for name, encode, app in runs:
+        best = min(timeit.repeat(lambda: encode(app, page), number=1, repeat=args.repeat))
+        size = len(encode(app, page))
+        print("%-32s %8.2f ms  %8d bytes" % (name, best * 1000, size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Login throughput of a running server at several concurrency levels.
+
+Signs up a throwaway user (or uses --username/--password) and fires POST
+/users/login from N threads at a time. Rejected logins (503, hashing pool
+full) are counted separately from successful ones.
+
+    python run.py &
+    python benchmarks/login_throughput.py --url http://127.0.0.1:5000 --levels 1,4,16,64
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def timed_login(url, credentials):
+    started = time.perf_counter()
+    status = post(url + '/users/login', credentials)
+    return status, time.perf_counter() - started
+
+def run_level(url, credentials, concurrency, requests):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(lambda _: timed_login(url, credentials), range(requests)))
+        elapsed = time.perf_counter() - started
+    ok = sorted(duration for status, duration in results if status == 200)
+    rejected = sum(1 for status, _ in results if status == 503)
+    failed = len(results) - len(ok) - rejected
+    p95 = ok[int(len(ok) * 0.95) - 1] if ok else 0
+    print("%5d %10.1f %10.1f %10.1f %9d %7d" % (
+        concurrency, len(ok) / elapsed, statistics.median(ok) * 1000 if ok else 0, p95 * 1000, rejected, failed))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--levels', default='1,4,16,64')
+    parser.add_argument('--requests', type=int, default=0, help='logins per level (default: 8 x concurrency)')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    credentials = {'username': args.username, 'password': args.password}
+    if not args.username:
+        name = 'bench-' + uuid.uuid4().hex[:12]
+        credentials = {'username': name, 'password': uuid.uuid4().hex}
+        post(args.url + '/users/signup', {
+            **credentials, 'email': name + '@example.com', 'first_name': 'Bench',
+            'last_name': 'Mark', 'birth_date': '2000-01-01'
+        })
+
+    print("%5s %10s %10s %10s %9s %7s" % ("conc", "logins/s", "p50 ms", "p95 ms", "rejected", "failed"))
+    for concurrency in (int(level) for level in args.levels.split(',')):
+        run_level(args.url, credentials, concurrency, args.requests or concurrency * 8)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Read throughput of a running server at several concurrency levels, to compare
+the development server with the preforked production setup.
+
+Fires GET requests at --paths (round robin) from N threads at a time for
+--seconds per level. Only 200/304 responses count as served.
+
+    python run.py &
+    python benchmarks/serving_throughput.py --url http://127.0.0.1:5000
+
+    gunicorn -c gunicorn.conf.py wsgi:app &
+    python benchmarks/serving_throughput.py --url http://127.0.0.1:8000
+"""
+import argparse
+import itertools
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PATHS = '/jobs/jobs?page_size=10,/jobs/jobs/facets,/jobs/jobs?sector=IT&page_size=10'
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+def run_level(url, paths, concurrency, seconds):
+    urls = itertools.cycle([url + path for path in paths])
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        results = []
+        while time.perf_counter() < deadline:
+            with lock:
+                target = next(urls)
+            started = time.perf_counter()
+            status = get(target)
+            results.append((status, time.perf_counter() - started))
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [result for results in executor.map(lambda _: client(), range(concurrency)) for result in results]
+    elapsed = time.perf_counter() - started
+    served = sorted(duration for status, duration in results if status in (200, 304))
+    failed = len(results) - len(served)
+    p95 = served[int(len(served) * 0.95) - 1] if served else 0
+    print("%5d %10.1f %10.1f %10.1f %7d" % (
+        concurrency, len(served) / elapsed, statistics.median(served) * 1000 if served else 0, p95 * 1000, failed))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='comma separated paths to request')
+    parser.add_argument('--levels', default='1,8,32,64')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    paths = args.paths.split(',')
+    print("%5s %10s %10s %10s %7s" % ("conc", "req/s", "p50 ms", "p95 ms", "failed"))
+    for concurrency in (int(level) for level in args.levels.split(',')):
+        run_level(args.url, paths, concurrency, args.seconds)
+
+if __name__ == '__main__':
+    main()
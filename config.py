@@ -3,3 +3,69 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'a_very_secret_key'
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/job-portal'
+
+    # How long browsers may cache CORS preflights, and public GETs before revalidating
+    CORS_MAX_AGE = int(os.environ.get('CORS_MAX_AGE') or 7200)
+    PUBLIC_CACHE_MAX_AGE = int(os.environ.get('PUBLIC_CACHE_MAX_AGE') or 10)
+
+    # Create the indexes declared in app/models.py when the app starts
+    MONGO_ENSURE_INDEXES = (os.environ.get('MONGO_ENSURE_INDEXES') or 'true').lower() == 'true'
+
+    # Keyword search backend for the job listing: 'mongo' (text index) or 'memory'
+    # (in-process BM25 index, loaded at startup and resynced every few seconds)
+    JOB_SEARCH_ENGINE = os.environ.get('JOB_SEARCH_ENGINE') or 'mongo'
+    JOB_SEARCH_BATCH_SIZE = int(os.environ.get('JOB_SEARCH_BATCH_SIZE') or 1000)
+    JOB_SEARCH_RESYNC_SECONDS = int(os.environ.get('JOB_SEARCH_RESYNC_SECONDS') or 60)
+
+    # How long facet counts for a given job search are cached
+    JOB_FACETS_CACHE_SECONDS = int(os.environ.get('JOB_FACETS_CACHE_SECONDS') or 30)
+
+    # Read-through cache for jobs, companies, user profiles and resumes (per process)
+    ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE') or 2048)
+    ENTITY_CACHE_SECONDS = int(os.environ.get('ENTITY_CACHE_SECONDS') or 60)
+
+    # How long filtered total_count values are memoized (count=approx)
+    COUNT_CACHE_SECONDS = int(os.environ.get('COUNT_CACHE_SECONDS') or 30)
+
+    # How long report histogram buckets that are over stay cached (they don't change)
+    HISTOGRAM_CACHE_SECONDS = int(os.environ.get('HISTOGRAM_CACHE_SECONDS') or 86400)
+
+    # Verified tokens kept per process, and for how long at most (never past their exp)
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 4096)
+    TOKEN_CACHE_SECONDS = int(os.environ.get('TOKEN_CACHE_SECONDS') or 300)
+
+    # bcrypt cost for new hashes; older hashes are upgraded at login
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)
+    # Threads hashing and checking passwords, and how many more requests may wait for one
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS') or os.cpu_count() or 2)
+    BCRYPT_QUEUE_LIMIT = int(os.environ.get('BCRYPT_QUEUE_LIMIT') or 16)
+
+    # Threads serving requests in each server process (gunicorn.conf.py)
+    SERVER_THREADS = int(os.environ.get('GUNICORN_THREADS') or 64)
+
+    # Concurrent requests per route class (endpoint or blueprint name, "exports" for
+    # current_page=0 listings, "events" for event streams) as name=limit:queue; see
+    # app/admission.py. Event streams hold a server thread each, so by default they
+    # may use half the threads of a process and the API keeps the other half
+    ADMISSION_LIMITS = os.environ.get('ADMISSION_LIMITS') or (
+        'exports=4:8,reports=4:8,messages.get_messages_for_user=16:32,events=%d:0' % (SERVER_THREADS // 2))
+    ADMISSION_WAIT_SECONDS = float(os.environ.get('ADMISSION_WAIT_SECONDS') or 2)
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER') or 1)
+
+    # Documents read per round trip when streaming current_page=0 exports
+    STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE') or 500)
+
+    # Jobs written per insert_many by the bulk import, and the most line errors it reports
+    JOB_IMPORT_BATCH_SIZE = int(os.environ.get('JOB_IMPORT_BATCH_SIZE') or 1000)
+    JOB_IMPORT_MAX_ERRORS = int(os.environ.get('JOB_IMPORT_MAX_ERRORS') or 1000)
+
+    # Server-sent events: how events reach every worker ('local' for a single worker,
+    # 'mongo' through a change stream, or 'package.module:Class'),
+    # events buffered per slow client, keep-alive interval, how long a stream stays
+    # open before the client reconnects, and most missed messages replayed per connection
+    EVENTS_FANOUT = os.environ.get('EVENTS_FANOUT') or 'local'
+    EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE') or 100)
+    EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS') or 15)
+    EVENTS_MAX_SECONDS = float(os.environ.get('EVENTS_MAX_SECONDS') or 300)
+    EVENTS_REPLAY_LIMIT = int(os.environ.get('EVENTS_REPLAY_LIMIT') or 500)
+    EVENTS_RETRY_MS = int(os.environ.get('EVENTS_RETRY_MS') or 3000)
@@ -0,0 +1,74 @@
+# Production server settings (gunicorn, installed separately):
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Every setting can be overridden from the environment. Signals to the master:
+#   HUP          re-read this file and replace the workers one by one (same code
+#                when the app is preloaded)
+#   USR2, then   start a new master with the new code next to the old one, then
+#   QUIT old     stop the old master once the new one serves
+#   TERM         graceful shutdown: workers finish their requests for up to
+#                graceful_timeout seconds (event streams are cut and resume
+#                with Last-Event-ID)
+import multiprocessing
+import os
+
+from config import Config
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:8000'
+
+# Worker processes, each with a pool of threads. Requests mostly wait on MongoDB,
+# so threads are cheap concurrency. Every open event stream holds a thread (idle,
+# it costs a stack and no CPU); the "events" admission class gives streams half
+# the threads by default, so a server holds WEB_CONCURRENCY * GUNICORN_THREADS / 2
+# open streams. Raise GUNICORN_THREADS to hold more.
+# Events reach streams connected to other workers through EVENTS_FANOUT=mongo; with
+# the default local fan-out they only reach streams of the worker that published
+# them (the others get them when they reconnect), which is logged at startup.
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = Config.SERVER_THREADS
+
+# Workers are replaced after this many requests (give or take the jitter, so they
+# don't all restart at once), which bounds the growth of the per-process caches
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 1000)
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER') or 100)
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 60)
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT') or 30)
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE') or 5)
+
+# Load the app once in the master (indexes ensured and the job search index built
+# once, memory shared with the workers) and fork the workers from it
+preload_app = (os.environ.get('GUNICORN_PRELOAD') or 'true').lower() == 'true'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or '-'
+errorlog = '-'
+
+def on_starting(server):
+    from app.admission import parse_limits
+    if server.cfg.workers > 1 and Config.EVENTS_FANOUT == 'local':
+        server.log.warning("%d workers with EVENTS_FANOUT=local: live events only reach streams connected to "
+                           "the worker that published them, the others get them when they reconnect. "
+                           "Set EVENTS_FANOUT=mongo to deliver them to every worker.", server.cfg.workers)
+    # Refuse an events limit under which open streams can starve the API
+    events = parse_limits(Config.ADMISSION_LIMITS).get('events')
+    if events is None or events[0] > server.cfg.threads // 2:
+        server.log.error("The events admission limit (%s) must be at most half of the %d threads per worker, "
+                         "or open event streams can hold every thread.",
+                         events[0] if events else "none", server.cfg.threads)
+        raise SystemExit(1)
+
+def when_ready(server):
+    # The master doesn't serve requests: it lets go of the MongoClient, the
+    # search resync thread and the event fan-out so no worker inherits them
+    if preload_app:
+        from app import before_fork
+        from wsgi import app
+        before_fork(app)
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import init_worker
+        from wsgi import app
+        init_worker(app)
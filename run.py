@@ -1,9 +1,8 @@
 from app import create_app
-from flask_cors import CORS
 
-app = create_app()
-CORS(app, resources={r"/*": {"origins": "*"}}, allow_headers=["Content-Type", "Authorization"], methods=["GET", "POST", "DELETE", "PUT", "OPTIONS"])
+app = create_app()  # CORS is configured in create_app
 
 
+# Development server only; production runs wsgi.py under gunicorn (gunicorn.conf.py)
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file